@@ -0,0 +1,52 @@
+import aiohttp
+
+
+class BackendError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class BackendClient:
+    def __init__(self, base_url, timeout=10):
+        """
+        Client of the CMSE backend API.
+
+        Event search goes through the backend's /get_events, so the bot uses the same long-lived
+        search index and result cache as every other client instead of building its own.
+
+        :param base_url: Backend address, e.g. http://backend:8000.
+        :param timeout: Total timeout of a request in seconds.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+    async def connect(self):
+        self.session = aiohttp.ClientSession(self.base_url, timeout=self.timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def request(self, method, path, token=None, **kwargs):
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        async with self.session.request(method, path, headers=headers, **kwargs) as response:
+            data = await response.json(content_type=None)
+            if response.status >= 400:
+                detail = data.get("detail") if isinstance(data, dict) else None
+                raise BackendError(response.status, detail or f"Backend error {response.status}")
+            return data
+
+    async def search_events(self, keywords, k=30):
+        """Return the events matching keywords (possibly an empty list)."""
+        data = await self.request("GET", "/get_events", params={"keywords": keywords, "k": k})
+        return data.get("events", [])
+
+    async def login(self, username, password):
+        """Return the /auth_user response with access_token, expires_in and user_id."""
+        return await self.request("POST", "/auth_user", params={"username": username, "password": password})
+
+    async def register_for_event(self, event_id, user_id, token):
+        return await self.request("POST", f"/register_for_event/{event_id}/{user_id}", token=token)
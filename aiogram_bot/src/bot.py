@@ -1,13 +1,17 @@
 import asyncio
+import hashlib
 import logging
 import os
 from aiogram import Bot, Dispatcher, html
-from aiogram.filters import Command
-from aiogram.types import Message
-import psycopg2
+from aiogram.filters import Command, CommandObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery, Message
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-import redis.asyncio as aioredis
-from neo4j import GraphDatabase
+from backend_client import BackendClient, BackendError
+from graph_sync import GraphSync
+from reminders import ReminderScheduler
+from storage import Storage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,49 +26,218 @@ NEO4J_URL = os.getenv("NEO4j_URL")
 NEO4J_USER = os.getenv("NEO4j_USER")
 NEO4J_PASSWORD = os.getenv("NEO4j_PASSWORD")
 
+# Connection pool sizes
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))
+REDIS_POOL_MAX = int(os.getenv("REDIS_POOL_MAX", "20"))
+NEO4J_POOL_MAX = int(os.getenv("NEO4J_POOL_MAX", "20"))
+
+# Backend API used for event search and registration
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "30"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+EVENTS_PER_PAGE = 5
+
+# Event reminders: lead times in minutes, messages per second, concurrent senders
+REMINDER_LEADS_MINUTES = [int(lead) for lead in os.getenv("REMINDER_LEADS_MINUTES", "1440,60").split(",")]
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "25"))
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "8"))
+REMINDER_INTERVAL = int(os.getenv("REMINDER_INTERVAL", "60"))
+
+# Mirroring of events, users and registrations into Neo4j
+GRAPH_SYNC_INTERVAL = int(os.getenv("GRAPH_SYNC_INTERVAL", "300"))
+GRAPH_SYNC_BATCH = int(os.getenv("GRAPH_SYNC_BATCH", "1000"))
+
 
 # Initialize bot and dispatcher
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
 
-# Initialize database connections
-conn = None
-redis_client = None
-neo4j_driver = None
-
+# Async, pooled connections to PostgreSQL, Redis and Neo4j
+storage = Storage(
+    POSTGRES_URL, REDIS_URL, NEO4J_URL, NEO4J_USER, NEO4J_PASSWORD,
+    pg_min_size=PG_POOL_MIN,
+    pg_max_size=PG_POOL_MAX,
+    redis_max_connections=REDIS_POOL_MAX,
+    neo4j_pool_size=NEO4J_POOL_MAX
+)
+backend = BackendClient(BACKEND_URL)
+reminders = ReminderScheduler(
+    storage, bot,
+    leads_minutes=REMINDER_LEADS_MINUTES,
+    interval=REMINDER_INTERVAL,
+    workers=REMINDER_WORKERS,
+    rate=REMINDER_RATE
+)
+graph_sync = GraphSync(storage, interval=GRAPH_SYNC_INTERVAL, batch_size=GRAPH_SYNC_BATCH)
+
+
+class EventsPage(CallbackData, prefix="events"):
+    key: str
+    page: int
+
+
+class RegisterEvent(CallbackData, prefix="register"):
+    event_id: int
+
+@dp.startup()
 async def on_startup():
-    global conn, redis_client, neo4j_driver
-
-    # Connect to PostgreSQL
-    #conn = await asyncpg.connect('postgresql://postgres@localhost/test')
-    conn = psycopg2.connect(POSTGRES_URL)
-    
-    # Connect to Redis
-    redis_client = aioredis.from_url(REDIS_URL)
-
-    # Connect to Neo4j
-    neo4j_driver = GraphDatabase.driver(NEO4J_URL, auth=(NEO4J_USER, NEO4J_PASSWORD))
+    await storage.connect()
+    await backend.connect()
+    await reminders.start()
+    await graph_sync.start()
+
+@dp.shutdown()
+async def on_shutdown():
+    # Polling stops on SIGINT/SIGTERM first, then the pools are closed
+    await graph_sync.stop()
+    await reminders.stop()
+    await backend.close()
+    await storage.close()
 
 @dp.message(Command("example"))
 async def example_command(message: Message):
     user_id = message.from_user.id
 
-    # Store data in Redis
-    await redis_client.set(f"user:{user_id}", "Example data")
-
-    # Store data in Neo4j
-    with neo4j_driver.session() as session:
-        session.run("MERGE (u:User {id: $id})", id=user_id)
+    # Store data in Redis and Neo4j without blocking other updates
+    await storage.remember_user(user_id, "Example data")
 
     await message.answer(f"Data for user {user_id} has been stored in all databases!")
 
+def search_key(keywords):
+    """Short key of a search, small enough for callback data (64 bytes)."""
+    return hashlib.sha1(" ".join(keywords.lower().split()).encode("utf-8")).hexdigest()[:16]
+
+def render_events_page(key, keywords, events, page):
+    """Text and inline keyboard of one page of search results."""
+    pages = max(1, -(-len(events) // EVENTS_PER_PAGE))
+    page = min(max(page, 0), pages - 1)
+    lines = [f"Events for {html.quote(keywords)} ({page + 1}/{pages}):", ""]
+    builder = InlineKeyboardBuilder()
+    for event in events[page * EVENTS_PER_PAGE:(page + 1) * EVENTS_PER_PAGE]:
+        places = f"{event.get('participants_count', 0)}/{event['max_people_count'] or '∞'}"
+        lines.append(
+            f"<b>#{event['id']}</b> {html.quote(event['sport_name'] or '')} — {html.quote(event['discipline'] or '')}\n"
+            f"{(event['date_start'] or '')[:10]}, {html.quote(event['city'] or '')}, participants: {places}"
+        )
+        builder.button(text=f"Register #{event['id']}", callback_data=RegisterEvent(event_id=event['id']))
+    builder.adjust(1)
+
+    navigation = InlineKeyboardBuilder()
+    if page > 0:
+        navigation.button(text="« Prev", callback_data=EventsPage(key=key, page=page - 1))
+    if page < pages - 1:
+        navigation.button(text="Next »", callback_data=EventsPage(key=key, page=page + 1))
+    builder.attach(navigation)
+    return "\n".join(lines), builder.as_markup()
+
+@dp.message(Command("events"))
+async def events_command(message: Message, command: CommandObject):
+    keywords = (command.args or "").strip()
+    if not keywords:
+        await message.answer("Usage: /events <keywords>")
+        return
+
+    # One search per keyword set; paging is served from the cached results
+    key = search_key(keywords)
+    cached = await storage.get_cached_search(key)
+    if cached is None:
+        try:
+            events = await backend.search_events(keywords, k=SEARCH_RESULTS)
+        except BackendError as e:
+            await message.answer(f"Search failed: {e.detail}")
+            return
+        cached = {"keywords": keywords, "events": events}
+        await storage.cache_search(key, keywords, events, SEARCH_CACHE_TTL)
+
+    if not cached["events"]:
+        await message.answer("No events found matching the keywords.")
+        return
+    text, markup = render_events_page(key, cached["keywords"], cached["events"], 0)
+    await message.answer(text, parse_mode="HTML", reply_markup=markup)
+
+@dp.callback_query(EventsPage.filter())
+async def events_page_callback(callback: CallbackQuery, callback_data: EventsPage):
+    cached = await storage.get_cached_search(callback_data.key)
+    if cached is None:
+        await callback.answer("These results have expired, please search again.", show_alert=True)
+        return
+    text, markup = render_events_page(callback_data.key, cached["keywords"], cached["events"], callback_data.page)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    await callback.answer()
+
+async def register_chat_for_event(chat_id, event_id):
+    """Register the CMSE user logged in from this chat; returns the message for the user."""
+    session = await storage.get_session(chat_id)
+    if session is None:
+        return "Please log in first: /login <username> <password>"
+    try:
+        await backend.register_for_event(event_id, session["user_id"], session["token"])
+    except BackendError as e:
+        return f"Registration failed: {e.detail}"
+    return f"You are registered for event #{event_id}."
+
+@dp.message(Command("register"))
+async def register_command(message: Message, command: CommandObject):
+    if not command.args or not command.args.strip().lstrip("#").isdigit():
+        await message.answer("Usage: /register <event id>")
+        return
+    await message.answer(await register_chat_for_event(message.chat.id, int(command.args.strip().lstrip("#"))))
+
+@dp.callback_query(RegisterEvent.filter())
+async def register_callback(callback: CallbackQuery, callback_data: RegisterEvent):
+    await callback.answer(await register_chat_for_event(callback.message.chat.id, callback_data.event_id), show_alert=True)
+
+@dp.message(Command("login"))
+async def login_command(message: Message, command: CommandObject):
+    args = (command.args or "").split()
+    # The password should not stay in the chat history
+    try:
+        await message.delete()
+    except Exception:
+        pass
+    if len(args) != 2:
+        await message.answer("Usage: /login <username> <password>")
+        return
+
+    try:
+        auth = await backend.login(*args)
+    except BackendError as e:
+        await message.answer(f"Login failed: {e.detail}")
+        return
+    await storage.save_session(message.chat.id, auth["user_id"], auth["access_token"], auth["expires_in"])
+    await storage.link_telegram(message.chat.id, auth["user_id"])
+    await message.answer(f"Logged in as {html.quote(args[0])}.", parse_mode="HTML")
+
+@dp.message(Command("suggest"))
+async def suggest_command(message: Message):
+    session = await storage.get_session(message.chat.id)
+    if session is None:
+        await message.answer("Please log in first: /login <username> <password>")
+        return
+
+    events = await storage.co_participant_events(session["user_id"], limit=EVENTS_PER_PAGE)
+    if not events:
+        await message.answer("No suggestions yet: register for some events first.")
+        return
+    lines = ["Events people from your events are going to:", ""]
+    builder = InlineKeyboardBuilder()
+    for event in events:
+        lines.append(
+            f"<b>#{event['id']}</b> {html.quote(event['sport_name'] or '')} — {html.quote(event['discipline'] or '')}\n"
+            f"{str(event['date_start'] or '')[:10]}, {html.quote(event['city'] or '')}, co-participants: {event['co_participants']}"
+        )
+        builder.button(text=f"Register #{event['id']}", callback_data=RegisterEvent(event_id=event['id']))
+    builder.adjust(1)
+    await message.answer("\n".join(lines), parse_mode="HTML", reply_markup=builder.as_markup())
+
 @dp.message()
 async def echo_handler(message: Message):
     await message.answer(f"You said: {message.text}")
 
 async def main():
-    await on_startup()
-    await dp.start_polling(bot)
+    # Every update is handled in its own task, so slow handlers do not hold up the others
+    await dp.start_polling(bot, handle_as_tasks=True)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+CONSTRAINTS = [
+    "CREATE CONSTRAINT event_id IF NOT EXISTS FOR (e:Event) REQUIRE e.id IS UNIQUE",
+    "CREATE CONSTRAINT user_id IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
+    "CREATE CONSTRAINT sport_name IF NOT EXISTS FOR (s:Sport) REQUIRE s.name IS UNIQUE",
+]
+
+# Each entity: keyset query over its change-tracking column and the UNWIND statement writing a batch.
+# The queries take ($1 changed-since, $2 cursor timestamp, $3 cursor key, $4 batch size).
+SYNCS = {
+    "competitions": {
+        "query": """
+            SELECT id AS key, updated_at AS changed_at, id, ekp_number, sport_name, sport_composition, discipline,
+                   city, country, competition_class, date_start, date_end, max_people_count, participants_count
+            FROM competitions
+            WHERE updated_at >= $1 AND (updated_at, id) > ($2, $3)
+            ORDER BY updated_at, id
+            LIMIT $4
+        """,
+        "write": """
+            UNWIND $rows AS row
+            MERGE (e:Event {id: row.id})
+            SET e.ekp_number = row.ekp_number, e.sport_name = row.sport_name, e.sport_composition = row.sport_composition,
+                e.discipline = row.discipline, e.city = row.city, e.country = row.country,
+                e.competition_class = row.competition_class, e.date_start = row.date_start,
+                e.date_end = row.date_end, e.max_people_count = row.max_people_count,
+                e.participants_count = row.participants_count
+            WITH e, row
+            CALL { WITH e MATCH (e)-[old:OF_SPORT]->() DELETE old }
+            WITH e, row WHERE row.sport_name IS NOT NULL
+            MERGE (s:Sport {name: row.sport_name})
+            MERGE (e)-[:OF_SPORT]->(s)
+        """,
+    },
+    "users": {
+        "query": """
+            SELECT id AS key, updated_at AS changed_at, id, username, city, COALESCE(sports, '{}') AS sports
+            FROM users
+            WHERE updated_at >= $1 AND (updated_at, id) > ($2, $3)
+            ORDER BY updated_at, id
+            LIMIT $4
+        """,
+        "write": """
+            UNWIND $rows AS row
+            MERGE (u:User {id: row.id})
+            SET u.username = row.username, u.city = row.city
+            WITH u, row
+            CALL { WITH u MATCH (u)-[old:LIKES]->() DELETE old }
+            WITH u, row
+            UNWIND row.sports AS sport
+            MERGE (s:Sport {name: sport})
+            MERGE (u)-[:LIKES]->(s)
+        """,
+    },
+    "registrations": {
+        # event_participants rows are only ever inserted, so registered_at tracks the changes
+        "query": """
+            SELECT event_id::bigint << 32 | user_id AS key, registered_at AS changed_at, event_id, user_id
+            FROM event_participants
+            WHERE registered_at >= $1 AND (registered_at, event_id::bigint << 32 | user_id) > ($2, $3)
+            ORDER BY registered_at, event_id::bigint << 32 | user_id
+            LIMIT $4
+        """,
+        "write": """
+            UNWIND $rows AS row
+            MERGE (u:User {id: row.user_id})
+            MERGE (e:Event {id: row.event_id})
+            MERGE (u)-[r:REGISTERED_FOR]->(e)
+            SET r.at = row.changed_at
+        """,
+    },
+}
+
+
+class GraphSync:
+    def __init__(self, storage, interval=300, batch_size=1000, overlap=timedelta(minutes=5)):
+        """
+        Mirrors competitions, users.sports and event registrations from PostgreSQL into Neo4j.
+
+        Only rows changed since the last run are read (by updated_at / registered_at, with a
+        keyset cursor), and every batch is written with a single UNWIND statement. The position
+        of each entity is stored in graph_sync_state. Runs re-read the last `overlap` of changes,
+        because a transaction that committed late may carry an earlier timestamp; the writes are
+        MERGEs, so reading a row twice is harmless.
+
+        :param storage: Storage with open PostgreSQL and Neo4j connections.
+        :param interval: Seconds between sync runs.
+        :param batch_size: Rows per UNWIND batch.
+        :param overlap: How far back each run re-reads changes.
+        """
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.task = None
+
+    async def start(self):
+        async with self.storage.neo4j.session() as session:
+            for constraint in CONSTRAINTS:
+                await session.run(constraint)
+        self.task = asyncio.create_task(self.loop())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def loop(self):
+        while True:
+            try:
+                counts = await self.sync_all()
+                if any(counts.values()):
+                    logging.info(f"Graph sync: {counts}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f"Error syncing the graph: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def sync_all(self):
+        # Events and users first, so registrations find their nodes
+        return {name: await self.sync(name) for name in ("competitions", "users", "registrations")}
+
+    async def sync(self, name):
+        """Copy the rows of one entity changed since its last sync; returns the number of rows."""
+        spec = SYNCS[name]
+        synced_until = await self.storage.pg.fetchval(
+            "SELECT synced_until FROM graph_sync_state WHERE name = $1", name
+        )
+        since = (synced_until or EPOCH) - self.overlap
+        cursor_at, cursor_key = since, -1
+        total = 0
+
+        while True:
+            rows = await self.storage.pg.fetch(spec["query"], since, cursor_at, cursor_key, self.batch_size)
+            if not rows:
+                break
+            batch = [dict(row) for row in rows]
+            async with self.storage.neo4j.session() as session:
+                await session.execute_write(self.write_batch, spec["write"], batch)
+            cursor_at, cursor_key = rows[-1]["changed_at"], rows[-1]["key"]
+            total += len(rows)
+            # Saved after every batch, so an interrupted run resumes where it stopped
+            await self.storage.pg.execute("""
+                INSERT INTO graph_sync_state (name, synced_until) VALUES ($1, $2)
+                ON CONFLICT (name) DO UPDATE SET synced_until = GREATEST(graph_sync_state.synced_until, EXCLUDED.synced_until)
+            """, name, cursor_at)
+        return total
+
+    @staticmethod
+    async def write_batch(tx, statement, rows):
+        result = await tx.run(statement, rows=rows)
+        await result.consume()
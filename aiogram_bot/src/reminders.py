@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+
+from aiogram import html
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+        Async token bucket: at most `capacity` messages at once, refilled at `rate` per second.
+
+        :param rate: Tokens added per second.
+        :param capacity: Maximum number of stored tokens (defaults to rate).
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReminderScheduler:
+    def __init__(self, storage, bot, leads_minutes=(24 * 60, 60), interval=60, workers=8,
+                 rate=25, max_attempts=5, queue_size=1000):
+        """
+        Sends reminders about upcoming events to the Telegram chats of registered participants.
+
+        Every `interval` seconds due reminders are written to event_reminders (one row per event,
+        chat and lead time), claimed in batches and sent by a pool of workers sharing a token
+        bucket, which keeps the bot under Telegram's flood limits. The row status is the delivery
+        state: pending -> queued -> sending -> sent (or failed), so a restart never resends a
+        message that may already have been delivered.
+
+        :param storage: Storage with an open PostgreSQL pool.
+        :param bot: aiogram Bot used for sending.
+        :param leads_minutes: How long before date_start reminders are sent, in minutes.
+        :param interval: Seconds between looking for due reminders.
+        :param workers: Number of concurrent senders.
+        :param rate: Messages per second across all workers.
+        :param max_attempts: Attempts before a reminder is marked failed.
+        :param queue_size: Maximum number of claimed reminders waiting for a worker.
+        """
+        self.storage = storage
+        self.bot = bot
+        leads = sorted(set(leads_minutes))
+        # Each lead time covers the window down to the next shorter one, so a participant
+        # linked late gets only the closest reminder instead of all of them at once
+        self.windows = list(zip(leads, [0] + leads[:-1]))
+        self.interval = interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.tasks = []
+
+    async def start(self):
+        await self.recover()
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self.schedule_loop()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Reminders claimed but not sent yet are picked up again on the next start
+        await self.storage.pg.execute("UPDATE event_reminders SET status = 'pending' WHERE status = 'queued'")
+
+    async def recover(self):
+        """Reset the state left by a previous run that stopped abruptly."""
+        await self.storage.pg.execute("UPDATE event_reminders SET status = 'pending' WHERE status = 'queued'")
+        # The message may or may not have reached Telegram; do not risk sending it twice
+        await self.storage.pg.execute("""
+            UPDATE event_reminders SET status = 'failed', last_error = 'Interrupted while sending'
+            WHERE status = 'sending'
+        """)
+
+    async def schedule_loop(self):
+        while True:
+            try:
+                created = await self.create_due_reminders()
+                claimed = await self.claim(self.queue.maxsize - self.queue.qsize())
+                if created or claimed:
+                    logging.info(f"Reminders: {created} new, {len(claimed)} queued for sending")
+                for reminder in claimed:
+                    await self.queue.put(reminder)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f"Error scheduling reminders: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def create_due_reminders(self):
+        """Add a pending reminder for every participant with a linked chat whose event is due."""
+        upper, lower = zip(*self.windows)
+        # Range scans on idx_competitions_date_start, then the (event_id, user_id) key of
+        # event_participants and idx_telegram_links_user_id
+        result = await self.storage.pg.execute("""
+            INSERT INTO event_reminders (event_id, chat_id, lead_minutes)
+            SELECT c.id, t.chat_id, w.lead
+            FROM unnest($1::int[], $2::int[]) AS w(lead, next_lead)
+            JOIN competitions c
+              ON c.date_start > LOCALTIMESTAMP + make_interval(mins => w.next_lead)
+             AND c.date_start <= LOCALTIMESTAMP + make_interval(mins => w.lead)
+            JOIN event_participants p ON p.event_id = c.id
+            JOIN telegram_links t ON t.user_id = p.user_id
+            ON CONFLICT DO NOTHING
+        """, list(upper), list(lower))
+        return int(result.split()[-1])
+
+    async def claim(self, limit):
+        """Mark up to limit pending reminders as queued and return them with their event."""
+        if limit <= 0:
+            return []
+        return await self.storage.pg.fetch("""
+            UPDATE event_reminders r SET status = 'queued'
+            FROM (
+                SELECT event_id, chat_id, lead_minutes FROM event_reminders
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY next_attempt_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            ) due
+            JOIN competitions c ON c.id = due.event_id
+            WHERE r.event_id = due.event_id AND r.chat_id = due.chat_id AND r.lead_minutes = due.lead_minutes
+            RETURNING r.event_id, r.chat_id, r.lead_minutes, r.attempts,
+                      c.sport_name, c.discipline, c.city, c.date_start
+        """, limit)
+
+    @staticmethod
+    def render(reminder):
+        return (
+            f"Reminder: <b>{html.quote(reminder['sport_name'] or '')}</b> — {html.quote(reminder['discipline'] or '')}\n"
+            f"starts {reminder['date_start']:%d.%m.%Y %H:%M} in {html.quote(reminder['city'] or '')} (event #{reminder['event_id']})."
+        )
+
+    async def worker(self):
+        while True:
+            reminder = await self.queue.get()
+            try:
+                await self.deliver(reminder)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception(f"Error delivering reminder: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def deliver(self, reminder):
+        key = (reminder["event_id"], reminder["chat_id"], reminder["lead_minutes"])
+        attempts = reminder["attempts"]
+        while True:
+            await self.bucket.acquire()
+            await self.set_status(key, "sending")
+            try:
+                await self.bot.send_message(reminder["chat_id"], self.render(reminder), parse_mode="HTML")
+            except TelegramRetryAfter as e:
+                # Flood control: wait as long as Telegram asks and try again right away
+                await self.set_status(key, "queued")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # The user blocked the bot or the chat is gone; retrying will not help
+                await self.fail(key, attempts + 1, str(e), retry=False)
+                return
+            except (TelegramAPIError, OSError) as e:
+                await self.fail(key, attempts + 1, str(e), retry=True)
+                return
+            await self.storage.pg.execute("""
+                UPDATE event_reminders SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
+                WHERE event_id = $1 AND chat_id = $2 AND lead_minutes = $3
+            """, *key)
+            return
+
+    async def set_status(self, key, status):
+        await self.storage.pg.execute(
+            "UPDATE event_reminders SET status = $4 WHERE event_id = $1 AND chat_id = $2 AND lead_minutes = $3",
+            *key, status
+        )
+
+    async def fail(self, key, attempts, error, retry):
+        """Record a failed attempt; retry later with exponential backoff until max_attempts."""
+        retry = retry and attempts < self.max_attempts
+        await self.storage.pg.execute("""
+            UPDATE event_reminders
+            SET status = $4, attempts = $5, last_error = $6,
+                next_attempt_at = CURRENT_TIMESTAMP + make_interval(secs => $7)
+            WHERE event_id = $1 AND chat_id = $2 AND lead_minutes = $3
+        """, *key, "pending" if retry else "failed", attempts, error, float(30 * 2 ** attempts))
@@ -0,0 +1,120 @@
+import json
+import logging
+
+import asyncpg
+import redis.asyncio as aioredis
+from neo4j import AsyncGraphDatabase
+
+
+class Storage:
+    def __init__(self, postgres_url, redis_url, neo4j_url, neo4j_user, neo4j_password,
+                 pg_min_size=1, pg_max_size=10, redis_max_connections=20, neo4j_pool_size=20,
+                 command_timeout=10):
+        """
+        Async connections of the bot to PostgreSQL, Redis and Neo4j.
+
+        Every store is used through a connection pool, so a slow query only holds one
+        connection while other updates keep being handled on the event loop.
+
+        :param pg_min_size: Connections opened up front in the PostgreSQL pool.
+        :param pg_max_size: Maximum number of PostgreSQL connections.
+        :param redis_max_connections: Maximum number of Redis connections.
+        :param neo4j_pool_size: Maximum number of Neo4j connections.
+        :param command_timeout: Seconds after which a PostgreSQL query is cancelled.
+        """
+        self.postgres_url = postgres_url
+        self.redis_url = redis_url
+        self.neo4j_url = neo4j_url
+        self.neo4j_auth = (neo4j_user, neo4j_password)
+        self.pg_min_size = pg_min_size
+        self.pg_max_size = pg_max_size
+        self.redis_max_connections = redis_max_connections
+        self.neo4j_pool_size = neo4j_pool_size
+        self.command_timeout = command_timeout
+        self.pg = None
+        self.redis = None
+        self.neo4j = None
+
+    async def connect(self):
+        self.pg = await asyncpg.create_pool(
+            self.postgres_url,
+            min_size=self.pg_min_size,
+            max_size=self.pg_max_size,
+            command_timeout=self.command_timeout
+        )
+        self.redis = aioredis.Redis(connection_pool=aioredis.ConnectionPool.from_url(
+            self.redis_url, max_connections=self.redis_max_connections
+        ))
+        self.neo4j = AsyncGraphDatabase.driver(
+            self.neo4j_url, auth=self.neo4j_auth, max_connection_pool_size=self.neo4j_pool_size
+        )
+
+    async def close(self):
+        """Close all pools; queries still running are waited for by asyncpg."""
+        if self.neo4j is not None:
+            await self.neo4j.close()
+        if self.redis is not None:
+            await self.redis.close()
+            await self.redis.connection_pool.disconnect()
+        if self.pg is not None:
+            await self.pg.close()
+        logging.info("Storage connections closed")
+
+    async def remember_user(self, user_id, data):
+        """Store a Telegram user in Redis and as a node in Neo4j."""
+        await self.redis.set(f"user:{user_id}", data)
+        async with self.neo4j.session() as session:
+            await session.execute_write(self.merge_user, user_id)
+
+    @staticmethod
+    async def merge_user(tx, user_id):
+        # :User nodes are CMSE users mirrored by GraphSync; Telegram ids live under their own label
+        await tx.run("MERGE (u:TelegramUser {id: $id})", id=user_id)
+
+    async def co_participant_events(self, user_id, limit=10):
+        """
+        Upcoming events that people registered for the same events as the user are going to,
+        ranked by how many of them go there.
+        """
+        async with self.neo4j.session() as session:
+            return await session.execute_read(self.read_co_participant_events, user_id, limit)
+
+    @staticmethod
+    async def read_co_participant_events(tx, user_id, limit):
+        result = await tx.run("""
+            MATCH (me:User {id: $user_id})-[:REGISTERED_FOR]->(:Event)<-[:REGISTERED_FOR]-(other:User)
+            WHERE other <> me
+            WITH me, collect(DISTINCT other) AS others
+            UNWIND others AS other
+            MATCH (other)-[:REGISTERED_FOR]->(e:Event)
+            WHERE e.date_start >= localdatetime() AND NOT (me)-[:REGISTERED_FOR]->(e)
+            RETURN e.id AS id, e.sport_name AS sport_name, e.discipline AS discipline, e.city AS city,
+                   e.date_start AS date_start, count(other) AS co_participants
+            ORDER BY co_participants DESC, e.date_start
+            LIMIT $limit
+        """, user_id=user_id, limit=limit)
+        return [record.data() async for record in result]
+
+    async def cache_search(self, key, keywords, events, ttl):
+        """Keep search results for paging through them without searching again."""
+        await self.redis.set(f"events:{key}", json.dumps({"keywords": keywords, "events": events}), ex=ttl)
+
+    async def get_cached_search(self, key):
+        """Return {"keywords", "events"} stored by cache_search, or None once it expired."""
+        value = await self.redis.get(f"events:{key}")
+        return json.loads(value) if value is not None else None
+
+    async def save_session(self, chat_id, user_id, token, ttl):
+        """Remember the backend access token of a chat until the token expires."""
+        await self.redis.set(f"session:{chat_id}", json.dumps({"user_id": user_id, "token": token}), ex=ttl)
+
+    async def get_session(self, chat_id):
+        value = await self.redis.get(f"session:{chat_id}")
+        return json.loads(value) if value is not None else None
+
+    async def link_telegram(self, chat_id, user_id):
+        """Record which CMSE user a chat belongs to (used to send event reminders)."""
+        await self.pg.execute("""
+            INSERT INTO telegram_links (chat_id, user_id) VALUES ($1, $2)
+            ON CONFLICT (chat_id) DO UPDATE SET user_id = EXCLUDED.user_id, linked_at = CURRENT_TIMESTAMP
+        """, chat_id, user_id)
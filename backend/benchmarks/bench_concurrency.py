@@ -0,0 +1,180 @@
+"""
+Latency of the real /get_events endpoint under concurrent load, with its blocking work (index
+search, extra-column query) run on the event loop versus off-loaded to the bounded thread pool
+by run_blocking, as main.py does since the off-loading change.
+
+Live mode is the reference measurement: point it at a running backend before and after the
+change (or any deployment) and compare the p99 at the same number of clients:
+    python benchmarks/bench_concurrency.py --url "http://localhost:8000/get_events?keywords=бокс" --clients 200
+
+In-process mode imports the app from src/main.py (it needs DATABASE_URL and JWT_SECRET like the
+backend), seeds --seed synthetic competitions and serves the app in a child process, once with
+run_blocking replaced by an inline call (the behaviour before the change) and once as shipped:
+    DATABASE_URL=postgresql://... python benchmarks/bench_concurrency.py --clients 200 --requests 5
+
+The seeded rows are deleted afterwards. The response cache is bypassed unless --cache is given,
+so every request runs the search.
+
+Measured in-process with --clients 200 --requests 5 --seed 5000 and the sparse backend on a
+single-core VM with a local PostgreSQL, two runs (the load client shares the one core, so the
+absolute numbers are pessimistic; the search itself is CPU-bound, so off-loading mostly buys the
+loop time to keep accepting and answering, not more throughput):
+    mode       requests     req/s    p50 ms    p99 ms
+    inline         1000      41.2    2879.6   16816.9
+    offloaded      1000      45.7    2844.8   15205.6
+    inline         1000      43.6    2852.1   16071.9
+    offloaded      1000      51.5    2526.6   12009.8
+
+Requires httpx.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+SPORTS = ["бокс", "самбо", "дзюдо", "плавание", "фехтование", "хоккей", "биатлон", "борьба"]
+BENCH_PREFIX = "BENCH-CONCURRENCY-"
+
+
+def make_entries(n_rows):
+    """Synthetic PDFParser tuples."""
+    return [
+        (SPORTS[i % len(SPORTS)].upper(), "Основной состав", f"{BENCH_PREFIX}{i}", "01.02.2024", "05.02.2024",
+         f"город{i % 300}", f"весовая категория {i % 17}", "Чемпионат России", "РОССИЯ", str(10 + i % 90),
+         "мужчины 19-40")
+        for i in range(n_rows)
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_backend(port, mode, backend_name, cache):
+    """
+    Child process: import the app from main.py, build its search index and serve it with uvicorn.
+
+    mode "inline" replaces run_blocking with a direct call, which runs the blocking work on the
+    event loop like the handlers did before the off-loading change; "offloaded" keeps it.
+    """
+    # Read by main.py on import; the slow request log would flood the output under this load
+    os.environ.setdefault("SLOW_REQUEST_MS", "0")
+    os.environ["SEARCH_BACKEND"] = backend_name
+    import main as backend
+
+    async def inline(func, *func_args, **kwargs):
+        return func(*func_args, **kwargs)
+
+    if not cache:
+        backend.cache.get_or_set = lambda namespace, key, loader, ttl=None: loader()
+    # Keep the benchmark from publishing snapshots next to the app
+    backend.search_index.snapshot_dir = None
+    backend.search_index.build()
+    if mode == "inline":
+        backend.run_blocking = inline
+    # No lifespan: the startup handlers would resume ingest jobs and download the station index
+    uvicorn.run(backend.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096,
+                timeout_keep_alive=120, lifespan="off")
+
+
+def wait_until_up(base_url, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/db_pool_stats", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Backend at {base_url} did not start")
+
+
+async def drive(client, urls, clients, requests_per_client):
+    latencies = []
+
+    async def worker():
+        for _ in range(requests_per_client):
+            url = random.choice(urls)
+            started = time.perf_counter()
+            response = await client.get(url)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def report(name, result):
+    print(f"{name:<10} {result['requests']:>8} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+async def run_in_process(args, limits):
+    # Importing main.py applies the schema, so seeding works on an empty database too
+    import main as backend
+
+    if args.seed:
+        backend.ingestor.ingest(make_entries(args.seed))
+    context = multiprocessing.get_context("spawn")
+    try:
+        for mode in ("inline", "offloaded"):
+            port = free_port()
+            server = context.Process(target=serve_backend, args=(port, mode, args.backend, args.cache), daemon=True)
+            server.start()
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                wait_until_up(base_url)
+                urls = [f"{base_url}/get_events?keywords={sport},город{city}&k=10"
+                        for sport in SPORTS for city in range(0, 300, 7)]
+                async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+                    report(mode, await drive(client, urls, args.clients, args.requests))
+            finally:
+                server.terminate()
+                server.join()
+    finally:
+        if args.seed:
+            with backend.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute("DELETE FROM competitions WHERE ekp_number LIKE %s", (f"{BENCH_PREFIX}%",))
+                conn.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=5, help="Requests per client")
+    parser.add_argument("--url", help="Benchmark a running backend at this URL")
+    parser.add_argument("--seed", type=int, default=5000, help="Synthetic competitions added in in-process mode")
+    parser.add_argument("--backend", default="sparse", help="SEARCH_BACKEND in in-process mode")
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache in in-process mode")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    print(f"{'mode':<10} {'requests':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    if args.url:
+        async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+            report("live", await drive(client, [args.url], args.clients, args.requests))
+        return
+    await run_in_process(args, limits)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""
+Compares row-by-row ingestion (SELECT COUNT(*) + INSERT per row, as parse_and_save_pdf used
+to do) with the bulk CompetitionIngestor on synthetic parsed rows.
+
+Needs a PostgreSQL database with the competitions table (started backend or docker-compose):
+    DATABASE_URL=postgresql://... python benchmarks/bench_ingest.py --rows 5000
+
+Both runs load into scratch copies of competitions, which are dropped afterwards.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from modules.db_controller import DatabasePool  # noqa: E402
+from modules.ingest_controller import CompetitionIngestor  # noqa: E402
+from modules.rag_controller import COMPETITION_COLUMNS  # noqa: E402
+
+
+def make_entries(n_rows, offset=0):
+    """Synthetic PDFParser tuples."""
+    return [
+        ("БОКС", "Основной состав", f"{i:016d}", "01.02.2024", "05.02.2024", f"город{i % 300}",
+         f"весовая категория {i % 17}", "Чемпионат России", "РОССИЯ", str(10 + i % 90), "мужчины 19-40")
+        for i in range(offset, offset + n_rows)
+    ]
+
+
+def row_by_row(db_pool, table, entries):
+    ingestor = CompetitionIngestor(db_pool, table=table)
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SET LOCAL datestyle = 'ISO, DMY'")
+        for entry in map(ingestor.normalize, entries):
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE ekp_number = %s", (entry[2],))
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(
+                    f"INSERT INTO {table} ({COMPETITION_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    entry
+                )
+        conn.commit()
+
+
+def bulk(db_pool, table, entries):
+    return CompetitionIngestor(db_pool, table=table).ingest(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--db-url", default=os.getenv("DATABASE_URL"))
+    args = parser.parse_args()
+
+    db_pool = DatabasePool(args.db_url, minconn=1, maxconn=2)
+    entries = make_entries(args.rows)
+    # Second load: half the rows repeat, a quarter of those with changed data
+    reload = make_entries(args.rows // 2, offset=args.rows // 2)
+    reload = [entry[:6] + ("изменено",) + entry[7:] if i % 4 == 0 else entry for i, entry in enumerate(reload)]
+    reload += make_entries(args.rows // 2, offset=args.rows)
+
+    for name, load in (("row-by-row", row_by_row), ("bulk", bulk)):
+        table = f"competitions_bench_{name.replace('-', '_')}"
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(f"CREATE TABLE {table} (LIKE competitions INCLUDING ALL)")
+            conn.commit()
+        try:
+            for label, batch in (("fresh", entries), ("reload", reload)):
+                started = time.perf_counter()
+                result = load(db_pool, table, batch)
+                elapsed = time.perf_counter() - started
+                counts = ""
+                if result:
+                    counts = f"  inserted={result['inserted']} updated={result['updated']} skipped={result['skipped']}"
+                print(f"{name:<11} {label:<7} {len(batch):>6} rows {elapsed:>8.3f} s {len(batch) / elapsed:>10.0f} rows/s{counts}")
+        finally:
+            with db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+                conn.commit()
+
+    db_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Compares the CompetitionSearcher search backends (faiss and sparse) on a synthetic corpus.
+
+Run from the backend directory:
+    python benchmarks/bench_search_backends.py --events 100000 --queries 200
+
+The dense FAISS matrix takes events * vocabulary * 4 bytes. When it does not fit into
+--max-dense-gb, FAISS is measured on the largest prefix of the corpus that fits and the
+report shows the estimated memory for the full corpus.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from modules.rag_controller import CompetitionSearcher  # noqa: E402
+
+SPORTS = ["БОКС", "САМБО", "ДЗЮДО", "ПЛАВАНИЕ", "ЛЕГКАЯ АТЛЕТИКА", "ФЕХТОВАНИЕ", "ХОККЕЙ", "БИАТЛОН"]
+COMPOSITIONS = ["Основной состав", "Молодежный (резервный) состав"]
+CLASSES = ["Чемпионат России", "Первенство России", "Кубок России", "Всероссийские соревнования"]
+
+
+def make_corpus(n_events, vocabulary_size, seed=0):
+    """Generate rows in the CompetitionSearcher.fetch_competitions column order."""
+    rng = np.random.default_rng(seed)
+    words = [f"слово{i}" for i in range(vocabulary_size)]
+    cities = [f"город{i}" for i in range(2000)]
+    rows = []
+    for i in range(n_events):
+        discipline = " ".join(words[j] for j in rng.integers(0, vocabulary_size, 6))
+        rows.append((
+            SPORTS[i % len(SPORTS)],
+            COMPOSITIONS[i % len(COMPOSITIONS)],
+            f"{i:016d}",
+            "2024-01-01",
+            "2024-01-05",
+            cities[rng.integers(0, len(cities))],
+            discipline,
+            CLASSES[i % len(CLASSES)],
+            "РОССИЯ",
+            int(rng.integers(10, 500)),
+            "мужчины женщины",
+        ))
+    return rows
+
+
+def make_queries(rows, n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(rows), n_queries)
+    return [f"{rows[i][0]}, {rows[i][5]}, {rows[i][6].split()[0]}" for i in picks]
+
+
+def matrix_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def run_backend(backend, rows, queries, k):
+    searcher = CompetitionSearcher(None, backend=backend)
+    searcher.data = list(rows)
+
+    started = time.perf_counter()
+    searcher.create_feature_vectors()
+    searcher.build_index()
+    build_seconds = time.perf_counter() - started
+
+    if backend == "faiss":
+        memory = searcher.index.ntotal * searcher.index.d * 4
+    else:
+        memory = matrix_nbytes(searcher.feature_vectors) + matrix_nbytes(searcher.postings)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        searcher.search_vectors(searcher.vectorizer.transform([query.replace(",", " ")]), k)
+        latencies.append(time.perf_counter() - started)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "backend": backend,
+        "events": len(rows),
+        "vocabulary": len(searcher.vectorizer.vocabulary_),
+        "build_s": build_seconds,
+        "memory_mb": memory / 2 ** 20,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-dense-gb", type=float, default=2.0)
+    args = parser.parse_args()
+
+    rows = make_corpus(args.events, args.vocabulary)
+    queries = make_queries(rows, args.queries)
+
+    results = [run_backend("sparse", rows, queries, args.k)]
+
+    full_dense_bytes = args.events * results[0]["vocabulary"] * 4
+    dense_events = min(args.events, int(args.max_dense_gb * 2 ** 30 / (results[0]["vocabulary"] * 4)))
+    print(f"Dense matrix for the full corpus would take {full_dense_bytes / 2 ** 30:.1f} GB")
+    if dense_events < args.events:
+        print(f"FAISS is measured on the first {dense_events} events (--max-dense-gb {args.max_dense_gb})")
+    if dense_events > 0:
+        results.append(run_backend("faiss", rows[:dense_events], queries, args.k))
+
+    print(f"{'backend':<8} {'events':>8} {'vocab':>8} {'build s':>9} {'memory MB':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['backend']:<8} {r['events']:>8} {r['vocabulary']:>8} {r['build_s']:>9.2f} "
+              f"{r['memory_mb']:>10.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Station name lookups: the linear substring scan of the old get_train_price draft versus
+StationIndex (exact dict, prefix and trigram matching), on synthetic station names.
+
+    python benchmarks/bench_station_index.py --stations 30000 --queries 1000
+
+Pass --csv to use a real (unzipped) tutu_routes.csv instead of synthetic names.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from modules.station_controller import StationIndex, normalize_name  # noqa: E402
+
+LETTERS = "абвгдежзиклмнопрстуфхцчшщэюя"
+
+
+def synthetic_stations(count, seed=0):
+    rng = random.Random(seed)
+    return [("".join(rng.choice(LETTERS) for _ in range(rng.randint(5, 14))).capitalize(), str(2000000 + i))
+            for i in range(count)]
+
+
+def linear_scan(stations, name):
+    name = name.lower()
+    for station_name, code in stations:
+        if name in station_name.lower():
+            return code
+    return None
+
+
+def timed(func, queries):
+    started = time.perf_counter()
+    for query in queries:
+        func(query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stations", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--csv", help="Path to tutu_routes.csv")
+    args = parser.parse_args()
+
+    if args.csv:
+        with open(args.csv, encoding="utf-8") as f:
+            index = StationIndex.from_tutu_csv(f)
+        stations = list(index.codes.items())
+    else:
+        stations = synthetic_stations(args.stations)
+
+    started = time.perf_counter()
+    index = StationIndex(stations)
+    print(f"build: {time.perf_counter() - started:.2f} s for {len(index)} names")
+
+    rng = random.Random(1)
+    names = [normalize_name(name) for name, _ in rng.sample(stations, min(args.queries, len(stations)))]
+    typos = [name[:-1] + "я" for name in names]
+
+    print(f"{'lookup':<16} {'us/query':>10}")
+    print(f"{'linear scan':<16} {timed(lambda name: linear_scan(stations, name), names[:100]):>10.1f}")
+    print(f"{'exact':<16} {timed(index.resolve_uncached, names):>10.1f}")
+    print(f"{'fuzzy':<16} {timed(index.resolve_uncached, typos):>10.1f}")
+    print(f"{'cached':<16} {timed(index.resolve, names + names):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,24 +13,96 @@ The application includes the following main features:
 
 The application uses the FastAPI framework, PostgreSQL database, and various utility modules to implement the functionality.
 """
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Body, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Dict, List, Optional
+from datetime import datetime
 import os
-import psycopg2
+import asyncio
+import base64
+import contextvars
+import functools
+import hashlib
+import json
+import tempfile
+import jwt
 from concurrent.futures import ThreadPoolExecutor
+from psycopg2 import errors
+from psycopg2.extras import Json
+from modules.ai_controller import SemanticSearchIndex, make_embedder
+from modules.auth_controller import TokenManager
+from modules.cache_controller import CacheManager
+from modules.db_controller import DatabasePool
 from modules.pdf_parser import PDFParser
 from modules.users_controller import UserManager
-from modules.rag_controller import CompetitionSearcher
-from modules.router_conroller import TravelService
+from modules.ingest_controller import CompetitionIngestor, IngestJobManager
+from modules.metrics_controller import Metrics, MetricsMiddleware
+from modules.rag_controller import CompetitionSearcher, SearchIndexService, COMPETITION_COLUMNS, SEARCH_MODES
+from modules.router_conroller import TravelService, HotellookProvider, TutuProvider, YandexRaspProvider, HOTELLOOK_URL
+from modules.station_controller import StationDirectory, TUTU_ROUTES_URL
 
 POSTGRES_URL = os.getenv("DATABASE_URL")
-conn = psycopg2.connect(POSTGRES_URL)
-cursor = conn.cursor()
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", str(DB_POOL_MAX)))
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "/tmp/cmse_uploads")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+HOTEL_PRICE_CACHE_TTL = int(os.getenv("HOTEL_PRICE_CACHE_TTL", "900"))
+HOTELLOOK_TIMEOUT = float(os.getenv("HOTELLOOK_TIMEOUT", "10"))
+TRANSPORT_TIMEOUT = float(os.getenv("TRANSPORT_TIMEOUT", "10"))
+YANDEX_RASP_API_KEY = os.getenv("YANDEX_RASP_API_KEY")
+STATION_INDEX_PATH = os.getenv("STATION_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stations", "tutu_stations.npz"))
+STATION_REFRESH_HOURS = float(os.getenv("STATION_REFRESH_HOURS", "24"))
+JWT_SECRET = os.getenv("JWT_SECRET")
+JWT_DEV_RANDOM_SECRET = os.getenv("JWT_DEV_RANDOM_SECRET") == "1"  # local development only: per-process random key
+TOKEN_TTL_MINUTES = int(os.getenv("TOKEN_TTL_MINUTES", "60"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+SEARCH_HYBRID_WEIGHT = float(os.getenv("SEARCH_HYBRID_WEIGHT", "0.5"))
+SEARCH_SNAPSHOT_DIR = os.getenv("SEARCH_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "search"))
+AI_EMBEDDER = os.getenv("AI_EMBEDDER", "hashing")  # "hashing" or a sentence-transformers model name
+AI_EMBEDDING_DIM = int(os.getenv("AI_EMBEDDING_DIM", "512"))
+AI_INDEX_TYPE = os.getenv("AI_INDEX_TYPE", "hnsw")
+AI_EMBED_BATCH = int(os.getenv("AI_EMBED_BATCH", "256"))
+# "lazy": built by a worker on its first /ai_route call, "startup": built when a worker starts, "off": /ai_route disabled
+AI_SEMANTIC_INDEX = os.getenv("AI_SEMANTIC_INDEX", "lazy")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))  # 0 disables the slow request log
+SLOW_REQUEST_SAMPLE = float(os.getenv("SLOW_REQUEST_SAMPLE", "1.0"))
+
+# Request, SQL and stage timings exposed at /metrics
+metrics = Metrics()
+
+# Shared connection pool used by every handler and module; every statement is timed by name
+db_pool = DatabasePool(
+    POSTGRES_URL,
+    minconn=DB_POOL_MIN,
+    maxconn=DB_POOL_MAX,
+    acquire_timeout=DB_POOL_TIMEOUT,
+    on_query=metrics.observe_sql
+)
 
 app = FastAPI()
-
-
-cursor.execute("""
+app.add_middleware(
+    MetricsMiddleware,
+    metrics=metrics,
+    slow_threshold=SLOW_REQUEST_MS / 1000,
+    slow_sample_rate=SLOW_REQUEST_SAMPLE
+)
+
+
+with db_pool.connection() as conn, conn.cursor() as cursor:
+    # Several workers may start at once; let only one of them create and migrate the schema
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('cmse_schema'))")
+    cursor.execute("""
         CREATE TABLE IF NOT EXISTS users (
             id SERIAL PRIMARY KEY,
             username VARCHAR(50) UNIQUE NOT NULL,
@@ -72,40 +144,340 @@ cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
         CREATE INDEX IF NOT EXISTS idx_competitions_sport_name ON competitions(sport_name);
         CREATE INDEX IF NOT EXISTS idx_competitions_ekp_number ON competitions(ekp_number);
-    """)
-conn.commit()
 
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id SERIAL PRIMARY KEY,
+            filename VARCHAR(255),
+            content_hash CHAR(64) UNIQUE NOT NULL,  -- SHA-256 содержимого файла
+            file_path TEXT,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',  -- queued / running / done / failed
+            rows_parsed INTEGER NOT NULL DEFAULT 0,
+            rows_inserted INTEGER NOT NULL DEFAULT 0,
+            rows_updated INTEGER NOT NULL DEFAULT 0,
+            rows_skipped INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP WITH TIME ZONE,
+            finished_at TIMESTAMP WITH TIME ZONE
+        );
+        CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status);
 
+        -- Участники и комментарии хранятся отдельными строками вместо массивов peoples/comments
+        ALTER TABLE competitions ADD COLUMN IF NOT EXISTS participants_count INTEGER NOT NULL DEFAULT 0;
 
-# Create a ThreadPoolExecutor for background tasks
-executor = ThreadPoolExecutor(max_workers=2)
+        CREATE TABLE IF NOT EXISTS event_participants (
+            event_id INTEGER NOT NULL REFERENCES competitions(id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            registered_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (event_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_event_participants_user_id ON event_participants(user_id);
+        -- Удаление регистрации (в том числе каскадом при удалении пользователя) освобождает место
+        CREATE OR REPLACE FUNCTION release_participant_seat() RETURNS trigger AS $$
+        BEGIN
+            UPDATE competitions SET participants_count = GREATEST(participants_count - 1, 0) WHERE id = OLD.event_id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS event_participants_release_seat ON event_participants;
+        CREATE TRIGGER event_participants_release_seat AFTER DELETE ON event_participants
+            FOR EACH ROW EXECUTE FUNCTION release_participant_seat();
+
+        CREATE TABLE IF NOT EXISTS event_comments (
+            id SERIAL PRIMARY KEY,
+            event_id INTEGER NOT NULL REFERENCES competitions(id) ON DELETE CASCADE,
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            rate SMALLINT NOT NULL CHECK (rate BETWEEN 0 AND 5),
+            text TEXT,
+            images JSONB NOT NULL DEFAULT '[]',
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_event_comments_event_id ON event_comments(event_id, created_at);
 
-def parse_and_save_pdf(file_path: str):
+        -- Чаты Telegram, из которых пользователь вошел через бота
+        CREATE TABLE IF NOT EXISTS telegram_links (
+            chat_id BIGINT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            linked_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_telegram_links_user_id ON telegram_links(user_id);
+
+        -- Напоминания бота о ближайших событиях и состояние их доставки
+        CREATE INDEX IF NOT EXISTS idx_competitions_date_start ON competitions(date_start);
+        CREATE TABLE IF NOT EXISTS event_reminders (
+            event_id INTEGER NOT NULL REFERENCES competitions(id) ON DELETE CASCADE,
+            chat_id BIGINT NOT NULL,
+            lead_minutes INTEGER NOT NULL,  -- За сколько минут до начала напоминать
+            status VARCHAR(16) NOT NULL DEFAULT 'pending',  -- pending / queued / sending / sent / failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP WITH TIME ZONE,
+            PRIMARY KEY (event_id, chat_id, lead_minutes)
+        );
+        CREATE INDEX IF NOT EXISTS idx_event_reminders_pending ON event_reminders(next_attempt_at) WHERE status = 'pending';
+
+        -- Отметки изменений для синхронизации графа Neo4j: переносятся только строки, измененные с прошлого раза
+        ALTER TABLE competitions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP;
+        CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = CURRENT_TIMESTAMP;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS competitions_touch_updated_at ON competitions;
+        CREATE TRIGGER competitions_touch_updated_at BEFORE UPDATE ON competitions
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+        DROP TRIGGER IF EXISTS users_touch_updated_at ON users;
+        CREATE TRIGGER users_touch_updated_at BEFORE UPDATE OF username, city, sports ON users
+            FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+        CREATE INDEX IF NOT EXISTS idx_competitions_updated_at ON competitions(updated_at, id);
+        CREATE INDEX IF NOT EXISTS idx_users_updated_at ON users(updated_at, id);
+        CREATE INDEX IF NOT EXISTS idx_event_participants_registered_at ON event_participants(registered_at);
+        -- Календарь /events: фильтры по виду спорта и городу, сортировка по (date_start, id).
+        -- Каждая комбинация фильтров читается диапазоном одного индекса, без сортировки и OFFSET
+        CREATE INDEX IF NOT EXISTS idx_competitions_calendar ON competitions(date_start, id) WHERE date_start IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_competitions_sport_calendar ON competitions(sport_name, date_start, id) WHERE date_start IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_competitions_city_calendar ON competitions(city, date_start, id) WHERE date_start IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_competitions_sport_city_calendar ON competitions(sport_name, city, date_start, id) WHERE date_start IS NOT NULL;
+
+        -- Полнотекстовый поиск на стороне PostgreSQL (SEARCH_MODE=fulltext/hybrid)
+        ALTER TABLE competitions ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(sport_name, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(discipline, '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(city, '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(competition_class, '')), 'C')
+        ) STORED;
+        CREATE INDEX IF NOT EXISTS idx_competitions_search_vector ON competitions USING GIN (search_vector);
+
+        CREATE TABLE IF NOT EXISTS graph_sync_state (
+            name VARCHAR(32) PRIMARY KEY,
+            synced_until TIMESTAMP WITH TIME ZONE NOT NULL
+        );
+        """)
+
+    # Миграция: переносим старые массивы peoples/comments в новые таблицы и очищаем их,
+    # поэтому повторный запуск ничего не дублирует
+    cursor.execute("""
+        INSERT INTO event_participants (event_id, user_id)
+        SELECT c.id, p.user_id
+        FROM competitions c CROSS JOIN LATERAL unnest(c.peoples) AS p(user_id)
+        WHERE c.peoples IS NOT NULL AND EXISTS (SELECT 1 FROM users u WHERE u.id = p.user_id)
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO event_comments (event_id, user_id, rate, text, images)
+        SELECT c.id, u.id,
+               LEAST(GREATEST(COALESCE((cm->>'rate')::smallint, 0), 0), 5),
+               cm->>'text',
+               COALESCE(cm->'images', '[]'::jsonb)
+        FROM competitions c
+        CROSS JOIN LATERAL unnest(c.comments) AS cm
+        LEFT JOIN users u ON u.id = (cm->>'user_id')::integer
+        WHERE c.comments IS NOT NULL;
+
+        UPDATE competitions c
+        SET participants_count = (SELECT COUNT(*) FROM event_participants p WHERE p.event_id = c.id),
+            peoples = NULL,
+            comments = NULL
+        WHERE c.peoples IS NOT NULL OR c.comments IS NOT NULL;
+
+        -- Места, оставшиеся занятыми после удаления пользователей до появления триггера
+        UPDATE competitions c
+        SET participants_count = p.registered
+        FROM (
+            SELECT c2.id, COUNT(ep.user_id) AS registered
+            FROM competitions c2 LEFT JOIN event_participants ep ON ep.event_id = c2.id
+            GROUP BY c2.id
+        ) p
+        WHERE p.id = c.id AND c.participants_count <> p.registered;
+        """)
+    conn.commit()
+
+
+# Bounded thread pool for blocking calls made from request handlers (psycopg2, bcrypt,
+# index search, requests). Sized like the connection pool so threads do not queue on it.
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking function in blocking_executor without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the request's context, so SQL and stage timings land in its trace
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(blocking_executor, functools.partial(context.run, func, *args, **kwargs))
+
+# Stateless user manager on top of the shared pool
+user_manager = UserManager(db_pool, bcrypt_rounds=BCRYPT_ROUNDS)
+
+# Access tokens issued by /auth_user; checking one costs an HMAC instead of bcrypt and a query
+tokens = TokenManager(JWT_SECRET, ttl=TOKEN_TTL_MINUTES * 60, allow_random_secret=JWT_DEV_RANDOM_SECRET)
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)) -> Dict:
+    """Dependency returning the user of the request's bearer token, or failing with 401."""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated.", headers={"WWW-Authenticate": "Bearer"})
     try:
-        # Parse the PDF and extract data
-        pdf_parser = PDFParser()
-        parsed_data = pdf_parser.parse(file_path)
-        
-        # Insert parsed data into the PostgreSQL database
-        for entry in parsed_data:
-            sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, genders_and_ages = entry
-            
-            # Check if the event already exists
-            cursor.execute("SELECT COUNT(*) FROM competitions WHERE ekp_number = %s", (ekp_number,))
-            exists = cursor.fetchone()[0] > 0
-            
-            if not exists:
-                cursor.execute("""
-                    INSERT INTO competitions (sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, peoples, genders_and_ages, comments)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """, (sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, [], genders_and_ages, []))
-        
-        # Commit the transaction
-        conn.commit()
-        
+        return tokens.verify(credentials.credentials)
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token.", headers={"WWW-Authenticate": "Bearer"})
+
+
+def check_same_user(user_id: int, current_user: Dict):
+    """Users may only act on their own account, unless they are admins."""
+    if current_user["id"] != user_id and not (current_user["admin"] or current_user["root"]):
+        raise HTTPException(status_code=403, detail="Not allowed for this user.")
+
+
+def check_admin(current_user: Dict):
+    """Only admins (and root) may act on other users' roles."""
+    if not (current_user["admin"] or current_user["root"]):
+        raise HTTPException(status_code=403, detail="Admin rights required.")
+
+# Bulk loader for parsed PDF rows
+ingestor = CompetitionIngestor(db_pool)
+
+# Shared search index, built once at startup and updated on ingestion
+search_index = SearchIndexService(
+    db_pool,
+    backend=os.getenv("SEARCH_BACKEND", "faiss"),
+    mode=SEARCH_MODE,
+    hybrid_weight=SEARCH_HYBRID_WEIGHT,
+    snapshot_dir=SEARCH_SNAPSHOT_DIR or None,
+    metrics=metrics
+)
+
+# Semantic search for /ai_route: embeddings of competitions in an approximate FAISS index
+semantic_index = SemanticSearchIndex(
+    db_pool,
+    make_embedder(AI_EMBEDDER, dim=AI_EMBEDDING_DIM),
+    index_type=AI_INDEX_TYPE,
+    batch_size=AI_EMBED_BATCH,
+    metrics=metrics
+)
+
+# Read-through cache for hot read endpoints; falls back to an in-process LRU without Redis
+cache = CacheManager(REDIS_HOST, port=REDIS_PORT, default_ttl=CACHE_TTL)
+
+# Tutu station codes, loaded from disk at startup and refreshed in the background
+stations = StationDirectory(
+    STATION_INDEX_PATH,
+    url=os.getenv("TUTU_ROUTES_URL", TUTU_ROUTES_URL),
+    refresh_interval=STATION_REFRESH_HOURS * 3600
+)
+
+# Hotel and transport price providers queried concurrently by /travel_info
+travel_providers = [
+    HotellookProvider(
+        token=os.getenv("HOTELLOOK_TOKEN"),
+        base_url=os.getenv("HOTELLOOK_URL", HOTELLOOK_URL),
+        timeout=HOTELLOOK_TIMEOUT,
+        cache_ttl=HOTEL_PRICE_CACHE_TTL
+    ),
+    TutuProvider(stations.resolve, timeout=TRANSPORT_TIMEOUT)
+]
+if YANDEX_RASP_API_KEY:
+    # Tutu station codes are Express-3 codes, which Yandex accepts with system=express
+    travel_providers.append(YandexRaspProvider(
+        YANDEX_RASP_API_KEY, station_resolver=stations.resolve, code_system="express", timeout=TRANSPORT_TIMEOUT
+    ))
+
+# Shared travel service: one async HTTP client, cached and coalesced provider lookups
+travel_service = TravelService(travel_providers, cache=cache)
+
+
+@app.on_event("startup")
+def build_search_index():
+    try:
+        # Map the snapshot written by another worker or an earlier run; build only when there is none
+        if not search_index.load_snapshot():
+            search_index.build()
     except Exception as e:
-        print(f"Error parsing PDF: {str(e)}")
-        # Handle the error (e.g., log it, notify an admin, etc.)
+        print(f"Error building search index: {str(e)}")
+    if AI_SEMANTIC_INDEX == "startup":
+        try:
+            semantic_index.build()
+        except Exception as e:
+            print(f"Error building semantic index: {str(e)}")
+    # Pick up uploads that were still waiting when the application stopped
+    ingest_jobs.resume()
+    stations.start()
+
+
+@app.on_event("shutdown")
+def close_search_index():
+    ingest_jobs.shutdown()
+    stations.stop()
+    search_index.close()
+    semantic_index.close()
+    cache.close()
+    blocking_executor.shutdown(wait=True)
+    db_pool.close()
+
+
+@app.on_event("shutdown")
+async def close_travel_service():
+    await travel_service.close()
+
+
+def parse_and_save_pdf(file_path: str, on_batch=None):
+    """Parse a PDF and load its competitions; raises on failure so the ingest job is marked failed."""
+    # Parse the PDF lazily; competitions come out as soon as each record is complete
+    pdf_parser = PDFParser(workers=PDF_PARSE_WORKERS)
+    parsed_data = metrics.timed_iter("pdf_parse", pdf_parser.parse_iter(file_path))
+
+    def handle_batch(batch):
+        # Make new competitions searchable as soon as their batch is committed
+        search_index.add_competitions(batch["inserted_rows"])
+        semantic_index.add_competitions(batch["inserted_rows"])
+        if batch["inserted"] or batch["updated"]:
+            cache.invalidate("events", "sport_names")
+        if on_batch is not None:
+            on_batch(batch)
+
+    # Bulk-load parsed data into the PostgreSQL database batch by batch
+    result = ingestor.ingest_stream(parsed_data, batch_size=INGEST_BATCH_SIZE, on_batch=handle_batch)
+    print(f"Ingested {file_path}: {result['inserted']} inserted, {result['updated']} updated, {result['skipped']} skipped")
+
+    # Changed rows need fresh vectors, so rebuild the index once at the end
+    if result["updated"]:
+        search_index.build()
+        if semantic_index.ready:
+            semantic_index.build()
+        cache.invalidate("events")
+    elif result["inserted"]:
+        # Share the grown index with the other workers
+        search_index.save_snapshot()
+    return result
+
+
+# Background ingestion jobs with their status stored in ingest_jobs
+ingest_jobs = IngestJobManager(db_pool, parse_and_save_pdf, workers=INGEST_WORKERS)
+
+
+async def save_upload(file: UploadFile):
+    """Stream an upload to UPLOAD_DIR in chunks, returning (file path, SHA-256 of the content)."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    temp_file = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".part", delete=False)
+    try:
+        with temp_file:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                await run_blocking(temp_file.write, chunk)
+        content_hash = digest.hexdigest()
+        file_path = os.path.join(UPLOAD_DIR, f"{content_hash}.pdf")
+        os.replace(temp_file.name, file_path)
+    except Exception:
+        os.remove(temp_file.name)
+        raise
+    return file_path, content_hash
 
 
 @app.post("/upload_pdf_db")
@@ -116,57 +488,197 @@ async def upload_pdf_db(file: UploadFile = File(...)):
     #if not file.filename.endswith('.pdf'):
     #    raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
     
-    # Save the uploaded file temporarily
-    temp_file_path = f"/tmp/{file.filename}"
-    with open(temp_file_path, "wb") as temp_file:
-        temp_file.write(await file.read())
-    
-    # Start a new thread to parse the PDF and save data
-    executor.submit(parse_and_save_pdf, temp_file_path)
+    # Stream the upload to disk and queue it; the same content is only ever processed once
+    file_path, content_hash = await save_upload(file)
+    job, created = await run_blocking(ingest_jobs.submit, file.filename, file_path, content_hash)
+
+    if not created:
+        if job["status"] == "done" and os.path.exists(file_path):
+            os.remove(file_path)
+        return {"message": "This PDF was already uploaded.", "job_id": job["id"], "status": job["status"]}
 
     # Return a success message immediately
-    return {"message": "PDF upload received. Processing in the background."}
+    return {"message": "PDF upload received. Processing in the background.", "job_id": job["id"], "status": job["status"]}
+
+
+@app.get("/ingest_jobs/{job_id}")
+async def get_ingest_job(job_id: int):
+    """Return the status and progress of a PDF ingestion job."""
+    job = await run_blocking(ingest_jobs.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found.")
+    return job
+
+
+MAX_BATCH_QUERIES = 500
+MAX_SEARCH_RESULTS = 50
+# Columns read from the database for every /get_events result, so clients can register for an event
+EVENT_EXTRA_COLUMNS = ["id", "participants_count"]
+
+
+def format_event(result, score=None):
+    """Convert a competition row (COMPETITION_COLUMNS order) into a response dict."""
+    event = {
+        "sport_name": result[0],
+        "sport_composition": result[1],
+        "ekp_number": result[2],
+        "date_start": result[3],
+        "date_end": result[4],
+        "city": result[5],
+        "discipline": result[6],
+        "competition_class": result[7],
+        "country": result[8],
+        "max_people_count": result[9],
+        "genders_and_ages": result[10]
+    }
+    if len(result) > 11:
+        event.update(zip(EVENT_EXTRA_COLUMNS, result[11:]))
+    if score is not None:
+        event["score"] = score
+    return event
+
+
+def check_search_mode(mode: Optional[str]) -> str:
+    """Resolve the requested search mode, defaulting to SEARCH_MODE."""
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"Search mode must be one of: {', '.join(SEARCH_MODES)}.")
+    return mode or search_index.mode
+
+
+def search_events(keywords: str, k: int, mode: Optional[str] = None):
+    results = search_index.search(keywords, k=k, extra_columns=EVENT_EXTRA_COLUMNS, mode=mode)  # Search the shared index
+    # Cached values are JSON, so encode dates the same way the response does
+    return jsonable_encoder([format_event(result, score) for result, score in results])
 
 
 @app.get("/get_events")
-async def get_events(keywords: Optional[str] = Query(None)):
-    """Retrieve events based on keywords."""
+async def get_events(
+    keywords: Optional[str] = Query(None),
+    k: int = Query(5, ge=1, le=MAX_SEARCH_RESULTS),
+    mode: Optional[str] = Query(None)
+):
+    """Retrieve events based on keywords, searching in the given mode (vector, fulltext or hybrid)."""
     if not keywords:
         raise HTTPException(status_code=400, detail="No keywords provided for search.")
+    mode = check_search_mode(mode)
 
     try:
-        searcher = CompetitionSearcher(POSTGRES_URL)
-        searcher.fetch_competitions()  # Fetch competitions data from the database
-        searcher.create_feature_vectors()  # Create feature vectors
-        results = searcher.search_competitions_by_keywords(keywords)  # Search by keywords
-        searcher.close()  # Close the database connection
+        # Popular queries are served from the cache; the key ignores case and extra spaces
+        cache_key = f"{mode}:{k}:{' '.join(keywords.lower().split())}"
+        events = await run_blocking(cache.get_or_set, "events", cache_key, functools.partial(search_events, keywords, k, mode))
 
-        if not results:
+        if not events:
             return {"message": "No events found matching the keywords."}
 
-        # Format results for output
-        formatted_results = []
-        for result in results:
-            formatted_results.append({
-                "sport_name": result[0],
-                "sport_composition": result[1],
-                "ekp_number": result[2],
-                "date_start": result[3],
-                "date_end": result[4],
-                "city": result[5],
-                "discipline": result[6],
-                "competition_class": result[7],
-                "country": result[8],
-                "max_people_count": result[9],
-                "genders_and_ages": result[10]
-            })
-
-        return {"events": formatted_results}
+        return {"events": events}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving events: {str(e)}")
 
 
+@app.post("/get_events/batch")
+async def get_events_batch(
+    keywords_list: List[str] = Body(...),
+    k: int = Query(5, ge=1, le=MAX_SEARCH_RESULTS),
+    mode: Optional[str] = Query(None)
+):
+    """Retrieve events for many keyword strings in one request."""
+    if not keywords_list:
+        raise HTTPException(status_code=400, detail="No keywords provided for search.")
+    if len(keywords_list) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} keyword sets per request.")
+    mode = check_search_mode(mode)
+
+    try:
+        # Same row shape as /get_events; the extra columns of all hits come from a single query
+        results = await run_blocking(
+            search_index.search_many, keywords_list, k=k, extra_columns=EVENT_EXTRA_COLUMNS, mode=mode
+        )
+        return {
+            "results": [
+                {"keywords": keywords, "events": [format_event(result, score) for result, score in events]}
+                for keywords, events in zip(keywords_list, results)
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving events: {str(e)}")
+
+
+MAX_EVENTS_PAGE = 100
+
+
+def encode_events_cursor(date_start: datetime, event_id: int) -> str:
+    """Opaque cursor pointing right after the (date_start, id) of the last event of a page."""
+    return base64.urlsafe_b64encode(json.dumps([date_start.isoformat(), event_id]).encode()).decode()
+
+
+def decode_events_cursor(cursor: str):
+    try:
+        date_start, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(date_start), int(event_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def fetch_events_page(sport: Optional[str], city: Optional[str], date_from: Optional[datetime],
+                      date_to: Optional[datetime], after, limit: int):
+    """
+    Read one page of events ordered by (date_start, id), starting after the `after` key.
+
+    The filters match one of the idx_competitions_*calendar indexes, so the page is a range
+    scan of limit + 1 index entries however deep the client pages.
+    """
+    conditions = ["date_start IS NOT NULL"]
+    params = []
+    if sport:
+        conditions.append("sport_name = %s")
+        params.append(sport)
+    if city:
+        conditions.append("city = %s")
+        params.append(city)
+    if date_from:
+        conditions.append("date_start >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append("date_start <= %s")
+        params.append(date_to)
+    if after:
+        conditions.append("(date_start, id) > (%s, %s)")
+        params.extend(after)
+
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT {COMPETITION_COLUMNS}, {", ".join(EVENT_EXTRA_COLUMNS)}
+            FROM competitions
+            WHERE {" AND ".join(conditions)}
+            ORDER BY date_start, id
+            LIMIT %s
+        """, params + [limit + 1])
+        rows = cursor.fetchall()
+
+    # One extra row tells whether there is a next page without a COUNT
+    next_cursor = encode_events_cursor(rows[limit - 1][3], rows[limit - 1][11]) if len(rows) > limit else None
+    return [format_event(row) for row in rows[:limit]], next_cursor
+
+
+@app.get("/events")
+async def list_events(
+    sport: Optional[str] = Query(None),
+    city: Optional[str] = Query(None),
+    date_from: Optional[datetime] = Query(None),
+    date_to: Optional[datetime] = Query(None),
+    limit: int = Query(20, ge=1, le=MAX_EVENTS_PAGE),
+    cursor: Optional[str] = Query(None)
+) -> Dict:
+    """List events filtered by sport, city and date range, sorted by date_start, one page at a time."""
+    after = decode_events_cursor(cursor) if cursor else None
+    try:
+        events, next_cursor = await run_blocking(fetch_events_page, sport, city, date_from, date_to, after, limit)
+        return {"events": events, "next_cursor": next_cursor}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing events: {str(e)}")
+
+
 @app.get("/travel_info")
 async def travel_info(
     departure_city: str,
@@ -174,7 +686,7 @@ async def travel_info(
     check_in: str,
     check_out: str,
     adults: Optional[int] = 2
-) -> Dict[str, str]:
+) -> Dict:
     """
     Получает информацию о ценах на отели и транспорт между городами.
     
@@ -183,27 +695,42 @@ async def travel_info(
     :param check_in: Дата заселения (в формате YYYY-MM-DD).
     :param check_out: Дата выселения (в формате YYYY-MM-DD).
     :param adults: Количество гостей (по умолчанию 2).
-    :return: Словарь с информацией о ценах на отели и транспорт.
+    :return: Словарь с информацией о ценах на отели и транспорт и статусом каждого поставщика.
     """
     try:
-        travel_service = TravelService()  # You can pass a token if needed
-        
-        # Get hotel prices in the arrival city
-        hotel_price = travel_service.get_hotel_price(arrival_city, check_in, check_out, adults=adults)
-        
-        # Assuming you have a method to calculate transport prices
-        transport_price = travel_service.get_transport_price(departure_city, arrival_city, check_out, api_key="YOUR_API_KEY")
-
-        return {
-            "hotel_price": hotel_price,
-            "transport_price": transport_price
-        }
+        # All providers are queried at once; the ones that time out are reported in "providers"
+        return await travel_service.get_travel_info(departure_city, arrival_city, check_in, check_out, adults=adults)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching travel information: {str(e)}")
 
+def semantic_search_events(query: str, k: int):
+    semantic_index.ensure_built()
+    results = semantic_index.search(query, k=k, extra_columns=EVENT_EXTRA_COLUMNS)
+    return jsonable_encoder([format_event(result, score) for result, score in results])
+
+
 @app.get("/ai_route")
-async def get_events():
-    return {"message": "NO MODEL!"}
+async def ai_route(
+    query: Optional[str] = Query(None),
+    k: int = Query(5, ge=1, le=MAX_SEARCH_RESULTS)
+):
+    """Retrieve events for a natural-language query, e.g. "youth wrestling in Kazan in spring"."""
+    if not query or not query.strip():
+        raise HTTPException(status_code=400, detail="No query provided for search.")
+    if AI_SEMANTIC_INDEX == "off":
+        raise HTTPException(status_code=503, detail="Semantic search is disabled.")
+
+    try:
+        cache_key = f"ai:{k}:{' '.join(query.lower().split())}"
+        events = await run_blocking(cache.get_or_set, "events", cache_key, functools.partial(semantic_search_events, query, k))
+
+        if not events:
+            return {"message": "No events found matching the query."}
+
+        return {"events": events}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving events: {str(e)}")
 
 
 @app.post("/register_user")
@@ -221,8 +748,8 @@ async def register_user(
 ):
     """Register a new user."""
     try:
-        user_manager = UserManager(POSTGRES_URL)
-        user_manager.register_user(
+        await run_blocking(
+            user_manager.register_user,
             username=username,
             email=email,
             phone=phone,
@@ -241,90 +768,156 @@ async def register_user(
 
 @app.post("/auth_user")
 async def auth_user(username: str, password: str):
-    """Authenticate a user."""
+    """Authenticate a user and issue an access token for the other endpoints."""
     try:
-        user_manager = UserManager(POSTGRES_URL)
-        if user_manager.login_user(username, password):
-            return {"message": "Login successful."}
-        else:
+        # bcrypt runs in the thread pool, so a login never blocks the event loop
+        user = await run_blocking(user_manager.authenticate, username, password)
+        if user is None:
             raise HTTPException(status_code=401, detail="Invalid username or password.")
+        access_token, expires_in = tokens.issue(user)
+        return {
+            "message": "Login successful.",
+            "access_token": access_token,
+            "token_type": "bearer",
+            "expires_in": expires_in,
+            "user_id": user["id"]
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error logging in: {str(e)}")
 
 @app.put("/edit_user/{user_id}")
-async def edit_user(user_id: int, user_data: Dict):
+async def edit_user(user_id: int, user_data: Dict, current_user: Dict = Depends(get_current_user)):
     """Edit user details."""
+    check_same_user(user_id, current_user)
     try:
-        user_manager = UserManager(POSTGRES_URL)
-        user_manager.edit_user(user_id, **user_data)
+        await run_blocking(user_manager.edit_user, user_id, **user_data)
         return {"message": "User  updated successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating user: {str(e)}")
 
+@app.put("/set_user_roles/{user_id}")
+async def set_user_roles(user_id: int, admin: Optional[bool] = None, root: Optional[bool] = None,
+                         current_user: Dict = Depends(get_current_user)):
+    """Grant or revoke the admin and root roles of a user (admins only, root only for root)."""
+    check_admin(current_user)
+    if root is not None and not current_user["root"]:
+        raise HTTPException(status_code=403, detail="Root rights required.")
+    try:
+        updated = await run_blocking(user_manager.set_roles, user_id, admin=admin, root=root)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating user roles: {str(e)}")
+    if not updated:
+        raise HTTPException(status_code=404, detail="User not found.")
+    return {"message": "User roles updated successfully."}
+
 @app.delete("/delete_user/{user_id}")
-async def delete_user(user_id: int):
+async def delete_user(user_id: int, current_user: Dict = Depends(get_current_user)):
     """Delete a user."""
+    check_same_user(user_id, current_user)
     try:
-        user_manager = UserManager(POSTGRES_URL)
-        user_manager.delete_user(user_id)
+        await run_blocking(user_manager.delete_user, user_id)
         return {"message": "User  deleted successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting user: {str(e)}")
 
+def save_event_registration(event_id: int, user_id: int):
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        # Take a seat and record the participant in one statement: the UPDATE locks the event row,
+        # so concurrent registrations are serialized and can never exceed max_people_count
+        try:
+            cursor.execute("""
+                WITH slot AS (
+                    UPDATE competitions SET participants_count = participants_count + 1
+                    WHERE id = %(event_id)s
+                      AND (max_people_count IS NULL OR participants_count < max_people_count)
+                    RETURNING id
+                ), registration AS (
+                    INSERT INTO event_participants (event_id, user_id)
+                    SELECT id, %(user_id)s FROM slot
+                    ON CONFLICT DO NOTHING
+                    RETURNING event_id
+                )
+                SELECT (SELECT COUNT(*) FROM slot), (SELECT COUNT(*) FROM registration)
+            """, {"event_id": event_id, "user_id": user_id})
+        except errors.ForeignKeyViolation:
+            raise HTTPException(status_code=404, detail="User not found.")
+        slot, registered = cursor.fetchone()
+
+        if registered:
+            conn.commit()  # Commit the changes
+            cache.invalidate("events")  # Search results include participants_count
+            return
+
+        conn.rollback()  # Release the seat taken by a duplicate registration
+        if slot:
+            raise HTTPException(status_code=409, detail="User is already registered for the event.")
+
+        # Check if the event exists
+        cursor.execute("""
+            SELECT EXISTS (SELECT 1 FROM event_participants WHERE event_id = competitions.id AND user_id = %s)
+            FROM competitions WHERE id = %s
+        """, (user_id, event_id))
+        row = cursor.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Event not found.")
+        if row[0]:
+            raise HTTPException(status_code=409, detail="User is already registered for the event.")
+        raise HTTPException(status_code=400, detail="Event is full.")
+
 @app.post("/register_for_event/{event_id}/{user_id}")
-async def register_for_event(event_id: int, user_id: int):
+async def register_for_event(event_id: int, user_id: int, current_user: Dict = Depends(get_current_user)):
     """Register a user for an event if not full."""
+    check_same_user(user_id, current_user)
     try:
-        user_manager = UserManager(POSTGRES_URL)
-        
-        # Check if the event exists
-        cursor.execute("SELECT max_people_count, peoples FROM competitions WHERE id = %s", (event_id,))
-        event = cursor.fetchone()
-        
-        if not event:
-            raise HTTPException(status_code=404, detail="Event not found.")
-        
-        max_people_count, peoples = event
-        
-        # Check if the event is full
-        if len(peoples) >= max_people_count:
-            raise HTTPException(status_code=400, detail="Event is full.")
-        
-        # Register user for the event
-        peoples.append(user_id)  # Add user ID to the event's peoples list
-        cursor.execute("UPDATE competitions SET peoples = %s WHERE id = %s", (peoples, event_id))
-        
-        # Add event ID to the user's events list
-        cursor.execute("UPDATE users SET events = array_append(events, %s) WHERE id = %s", (event_id, user_id))
-        
-        conn.commit()  # Commit the changes
+        await run_blocking(save_event_registration, event_id, user_id)
         return {"message": "User  registered for the event successfully."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error registering for event: {str(e)}")
 
+def fetch_sport_names():
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT sport_name FROM competitions")
+        return [sport[0] for sport in cursor.fetchall()]
+
 @app.get("/get_sport_names")
 async def get_sport_names() -> Dict[str, List[str]]:
     """Retrieve all unique sport names from the competitions."""
     try:
-        cursor.execute("SELECT DISTINCT sport_name FROM competitions")
-        sport_names = cursor.fetchall()
-        
-        # Extract sport names from the fetched results
-        unique_sport_names = [sport[0] for sport in sport_names]
+        # The list only changes when a PDF is ingested, which invalidates it
+        unique_sport_names = await run_blocking(cache.get_or_set, "sport_names", "all", fetch_sport_names)
 
         return {"sport_names": unique_sport_names}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sport names: {str(e)}")
 
+def save_event_comment(event_id: int, comment: Dict):
+    # Insert the comment as its own row in event_comments
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        try:
+            cursor.execute("""
+                INSERT INTO event_comments (event_id, user_id, rate, text, images)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (event_id, comment["user_id"], comment["rate"], comment["text"], Json(comment["images"])))
+        except errors.ForeignKeyViolation:
+            raise HTTPException(status_code=404, detail="Event or user not found.")
+        
+        conn.commit()  # Commit the changes
+
 @app.post("/comment_event/{event_id}/{user_id}")
 async def comment_event(
     event_id: int,
     user_id: int,
     rate: int,
     text: str,
-    images: List[str] = []
+    images: List[str] = [],
+    current_user: Dict = Depends(get_current_user)
 ):
     """Submit a comment for an event."""
+    check_same_user(user_id, current_user)
     try:
         # Validate the rate
         if rate < 0 or rate > 5:
@@ -338,18 +931,32 @@ async def comment_event(
             "images": images
         }
 
-        # Insert the comment into the event's comments array
-        cursor.execute("""
-            UPDATE competitions 
-            SET comments = array_append(comments, %s) 
-            WHERE id = %s
-        """, (comment, event_id))
-        
-        conn.commit()  # Commit the changes
+        await run_blocking(save_event_comment, event_id, comment)
         return {"message": "Comment submitted successfully."}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error submitting comment: {str(e)}")
 
+@app.get("/db_pool_stats")
+async def db_pool_stats() -> Dict[str, float]:
+    """Return connection pool usage metrics."""
+    return db_pool.stats()
+
+@app.get("/cache_stats")
+async def cache_stats() -> Dict:
+    """Return cache hit and miss counters."""
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, SQL and stage timings and pool usage in the Prometheus text format."""
+    for key, value in db_pool.stats().items():
+        metrics.describe(f"cmse_db_pool_{key}", "counter" if key.endswith("_total") else "gauge", f"Database pool {key}.")
+        metrics.set(f"cmse_db_pool_{key}", value)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root() -> Dict[str, str]:
     return {"message": "Welcome to CMSE Backend!"}
\ No newline at end of file
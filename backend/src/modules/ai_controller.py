@@ -0,0 +1,211 @@
+import threading
+from contextlib import nullcontext
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+import faiss
+
+from modules.rag_controller import COMPETITION_COLUMNS, fetch_extra_columns
+
+AI_INDEX_TYPES = ("hnsw", "ivf")
+
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+MONTHS = ("январь", "февраль", "март", "апрель", "май", "июнь",
+          "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь")
+SEASONS = ("зима", "зима", "весна", "весна", "весна", "лето",
+           "лето", "лето", "осень", "осень", "осень", "зима")
+
+
+def competition_text(row):
+    """Text embedded for a competition row (COMPETITION_COLUMNS order)."""
+    (sport_name, sport_composition, _, date_start, _, city, discipline,
+     competition_class, country, _, genders_and_ages) = row[:11]
+    parts = [sport_name, discipline, sport_composition, competition_class, city, country]
+    if genders_and_ages:
+        parts.extend(genders_and_ages if isinstance(genders_and_ages, (list, tuple)) else [genders_and_ages])
+    # Queries talk about "spring" or "in March" rather than dates
+    if hasattr(date_start, "month"):
+        parts.extend([MONTHS[date_start.month - 1], SEASONS[date_start.month - 1]])
+    return " ".join(str(part) for part in parts if part)
+
+
+class HashingEmbedder:
+    def __init__(self, dim=512):
+        """
+        Deterministic embedder without a model: L2-normalized hashed character n-grams.
+
+        Word-boundary n-grams make different forms of a word ("Казань", "Казани") close,
+        which covers most keyword-like queries; it is also used in tests.
+
+        :param dim: Dimensionality of the vectors.
+        """
+        self.dim = dim
+        self.vectorizer = HashingVectorizer(
+            n_features=dim, analyzer="char_wb", ngram_range=(3, 4),
+            alternate_sign=False, norm="l2", dtype=np.float32
+        )
+
+    def embed(self, texts):
+        return self.vectorizer.transform([text.lower() for text in texts]).toarray()
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name=DEFAULT_MODEL, batch_size=64):
+        """
+        Local sentence-transformers model run on the CPU (needs the sentence-transformers package).
+
+        :param model_name: Model name or path; the default is a small multilingual model.
+        :param batch_size: Texts encoded per forward pass.
+        """
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self.model.encode(
+            list(texts), batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+
+def make_embedder(name="hashing", dim=512):
+    """"hashing" for HashingEmbedder, anything else is a sentence-transformers model name."""
+    if name == "hashing":
+        return HashingEmbedder(dim=dim)
+    return SentenceTransformerEmbedder(name)
+
+
+class SemanticSearchIndex:
+    def __init__(self, db_pool, embedder, index_type="hnsw", hnsw_m=32, ef_search=64, nprobe=8, batch_size=256,
+                 metrics=None):
+        """
+        Natural-language competition search over embeddings in an approximate FAISS index.
+
+        Vectors are normalized, so the inner product is the cosine similarity. "hnsw" needs no
+        training and takes new rows at any time; "ivf" is trained on the rows present at build
+        time (and falls back to HNSW while there are too few of them to train on).
+
+        :param db_pool: Shared DatabasePool (None for an index built from rows given by hand).
+        :param embedder: Object with a dim attribute and embed(texts) -> float32 array.
+        :param index_type: One of AI_INDEX_TYPES.
+        :param hnsw_m: Neighbours per HNSW node.
+        :param ef_search: HNSW candidate list size at query time (recall vs. speed).
+        :param nprobe: IVF lists visited per query.
+        :param batch_size: Rows embedded at once on build and ingestion.
+        :param metrics: Optional Metrics registry receiving embed/index_build/semantic_search timings.
+        """
+        if index_type not in AI_INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        self.db_pool = db_pool
+        self.embedder = embedder
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.index = None
+        self.data = []
+        self.ekp_numbers = set()
+        self.lock = threading.RLock()
+        # Serializes build() and add_competitions(), so rows added during a build are neither lost nor
+        # added twice; searches only take self.lock and keep using the old index meanwhile
+        self.write_lock = threading.RLock()
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def timed(self, stage):
+        return self.metrics.stage(stage) if self.metrics is not None else nullcontext()
+
+    def embed(self, rows):
+        """Embed competition rows in batches of batch_size."""
+        with self.timed("embed"):
+            vectors = [
+                self.embedder.embed([competition_text(row) for row in rows[start:start + self.batch_size]])
+                for start in range(0, len(rows), self.batch_size)
+            ]
+        return np.vstack(vectors) if vectors else np.empty((0, self.embedder.dim), dtype=np.float32)
+
+    def create_index(self, vectors):
+        d = self.embedder.dim
+        nlist = max(1, int(np.sqrt(len(vectors))))
+        # FAISS wants about 39 training points per list
+        if self.index_type == "ivf" and len(vectors) >= 39 * nlist and nlist > 1:
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(d), d, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = self.nprobe
+            return index
+        index = faiss.IndexHNSWFlat(d, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = self.ef_search
+        return index
+
+    def build(self, rows=None):
+        """Embed all competitions (fetched from the database unless rows are given) and build the index."""
+        with self.write_lock:
+            if rows is None:
+                with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute(f"SELECT {COMPETITION_COLUMNS} FROM competitions")
+                    rows = cursor.fetchall()
+            rows = list(rows)
+            vectors = self.embed(rows)
+            with self.timed("index_build"):
+                index = self.create_index(vectors)
+                if len(vectors):
+                    index.add(vectors)
+            with self.lock:
+                self.index = index
+                self.data = rows
+                self.ekp_numbers = {row[2] for row in rows}
+
+    def ensure_built(self):
+        """Build the index on first use; concurrent first callers wait for a single build."""
+        if self.ready:
+            return
+        with self.write_lock:
+            if not self.ready:
+                self.build()
+
+    def add_competitions(self, entries):
+        """Embed freshly inserted competitions in batches and add them to the index."""
+        with self.write_lock:
+            if not self.ready:
+                return
+            # A build that ran after the rows were committed already has them
+            entries = [entry for entry in entries if entry[2] not in self.ekp_numbers]
+            if not entries:
+                return
+            vectors = self.embed(entries)
+            with self.lock:
+                self.index.add(vectors)
+                self.data.extend(entries)
+                self.ekp_numbers.update(entry[2] for entry in entries)
+
+    def search(self, query: str, k=5, extra_columns=None):
+        """
+        Find the competitions closest to a natural-language query.
+
+        :return: List of (row, score) pairs, the score being the cosine similarity.
+        """
+        if not query.strip():
+            return []
+        with self.timed("embed"):
+            vector = self.embedder.embed([query])
+        with self.lock, self.timed("semantic_search"):
+            if not self.ready or self.index.ntotal == 0:
+                return []
+            scores, indices = self.index.search(vector, k)
+            hits = [(self.data[idx], float(score)) for idx, score in zip(indices[0], scores[0]) if idx != -1]
+
+        if extra_columns:
+            extras = fetch_extra_columns(self.db_pool, {row[2] for row, _ in hits}, extra_columns)
+            hits = [(tuple(row) + extras.get(row[2], (None,) * len(extra_columns)), score) for row, score in hits]
+        return hits
+
+    def close(self):
+        with self.lock:
+            self.index = None
+            self.data = []
+            self.ekp_numbers = set()
@@ -0,0 +1,61 @@
+import secrets
+import time
+
+import jwt
+
+
+class TokenManager:
+    def __init__(self, secret=None, ttl=3600, algorithm="HS256", allow_random_secret=False):
+        """
+        Issues and verifies signed access tokens (JWT) for logged in users.
+
+        Verifying a token is a single HMAC check, so authenticated requests do not
+        touch the database or bcrypt.
+
+        :param secret: Signing key shared by all backend workers.
+        :param ttl: Token lifetime in seconds.
+        :param algorithm: JWT signing algorithm.
+        :param allow_random_secret: Generate a random key when secret is empty instead of failing.
+                                    For local development only: every worker process gets its own
+                                    key, so tokens are rejected by the other workers and after a restart.
+        """
+        if not secret:
+            if not allow_random_secret:
+                raise ValueError("JWT_SECRET is not set; tokens must be signed with a key shared by all workers.")
+            print("JWT_SECRET is not set, using a random per-process key (development only).")
+            secret = secrets.token_urlsafe(32)
+        self.secret = secret
+        self.ttl = ttl
+        self.algorithm = algorithm
+
+    def issue(self, user):
+        """
+        Create a token for a user dict with "id", "username", "root" and "admin".
+
+        :return: Tuple (token, lifetime in seconds).
+        """
+        now = int(time.time())
+        claims = {
+            "sub": str(user["id"]),
+            "username": user["username"],
+            "root": bool(user["root"]),
+            "admin": bool(user["admin"]),
+            "iat": now,
+            "exp": now + self.ttl,
+        }
+        return jwt.encode(claims, self.secret, algorithm=self.algorithm), self.ttl
+
+    def verify(self, token):
+        """
+        Check the signature and expiry of a token.
+
+        :return: User dict with "id", "username", "root" and "admin".
+        :raises jwt.InvalidTokenError: If the token is malformed, forged or expired.
+        """
+        claims = jwt.decode(token, self.secret, algorithms=[self.algorithm], options={"require": ["sub", "exp"]})
+        return {
+            "id": int(claims["sub"]),
+            "username": claims.get("username"),
+            "root": claims.get("root", False),
+            "admin": claims.get("admin", False),
+        }
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+
+class LocalLRUCache:
+    def __init__(self, max_entries=1024):
+        """
+        Small thread-safe LRU cache with per-entry expiry, used while Redis is unavailable.
+
+        :param max_entries: Number of entries kept before the least recently used one is evicted.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired."""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CacheManager:
+    def __init__(self, host=None, port=6379, db=0, prefix="cmse", default_ttl=300, local_max_entries=1024,
+                 socket_timeout=0.5, retry_interval=30.0):
+        """
+        Read-through cache for JSON-serializable results, stored in Redis.
+
+        Keys are grouped in namespaces ("events", "sport_names", ...). Every namespace has a
+        version number stored in Redis that is part of its keys, so invalidating a namespace is a
+        single INCR and the old entries simply expire. When Redis is not configured or does not
+        answer, values are kept in an in-process LRU cache instead and Redis is tried again
+        after retry_interval seconds.
+
+        :param host: Redis host (None keeps everything in the in-process cache).
+        :param port: Redis port.
+        :param db: Redis database number.
+        :param prefix: Prefix of every key written by this cache.
+        :param default_ttl: Time to live of cached values in seconds.
+        :param local_max_entries: Size of the in-process LRU cache.
+        :param socket_timeout: Seconds to wait for Redis before falling back to the local cache.
+        :param retry_interval: Seconds to wait before trying Redis again after an error.
+        """
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.retry_interval = retry_interval
+        self.redis = None
+        if host:
+            self.redis = redis.Redis(host=host, port=port, db=db, socket_timeout=socket_timeout,
+                                     socket_connect_timeout=socket_timeout)
+        self.local = LocalLRUCache(local_max_entries)
+        self.redis_down_until = 0.0
+        self.stats_lock = threading.Lock()
+        self.counters = {}
+        # Local counterpart of the Redis version keys: invalidations per namespace
+        self.local_generations = {}
+        self.redis_errors_total = 0
+
+    @staticmethod
+    def make_key(key):
+        """Keys can be arbitrary user input, so they are hashed to a fixed length."""
+        return hashlib.sha1(str(key).encode("utf-8")).hexdigest()
+
+    def redis_available(self):
+        return self.redis is not None and time.monotonic() >= self.redis_down_until
+
+    def redis_failed(self, error):
+        print(f"Redis unavailable, using the local cache: {str(error)}")
+        with self.stats_lock:
+            self.redis_errors_total += 1
+        self.redis_down_until = time.monotonic() + self.retry_interval
+
+    def count(self, namespace, counter):
+        with self.stats_lock:
+            counters = self.counters.setdefault(namespace, {"hits": 0, "misses": 0})
+            counters[counter] += 1
+
+    def version_key(self, namespace):
+        return f"{self.prefix}:{namespace}:version"
+
+    def namespace_version(self, namespace):
+        """
+        Current version of a namespace: (Redis version counter or None while Redis is down,
+        number of local invalidations). invalidate() moves both forward.
+        """
+        redis_version = None
+        if self.redis_available():
+            try:
+                redis_version = int(self.redis.get(self.version_key(namespace)) or 0)
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        with self.stats_lock:
+            return redis_version, self.local_generations.get(namespace, 0)
+
+    def get(self, namespace, key, version=None):
+        """
+        Return the cached value and count a hit or a miss.
+
+        :param version: Namespace version from namespace_version() (read here if not given).
+        :return: Tuple (found, value).
+        """
+        key = self.make_key(key)
+        redis_version, _ = version or self.namespace_version(namespace)
+        if redis_version is not None and self.redis_available():
+            try:
+                redis_key = f"{self.prefix}:{namespace}:{redis_version}:{key}"
+                value = self.redis.get(redis_key)
+                if value is not None:
+                    self.count(namespace, "hits")
+                    return True, json.loads(value)
+                self.count(namespace, "misses")
+                return False, None
+            except redis.RedisError as e:
+                self.redis_failed(e)
+
+        value = self.local.get(f"{namespace}:{key}")
+        if value is not None:
+            self.count(namespace, "hits")
+            return True, value
+        self.count(namespace, "misses")
+        return False, None
+
+    def set(self, namespace, key, value, ttl=None, version=None):
+        """
+        Cache a value under the given namespace version (the current one if not given).
+
+        A value computed before an invalidation is written under the old version, where it is
+        never read, so it cannot replace fresher data.
+        """
+        ttl = ttl or self.default_ttl
+        key = self.make_key(key)
+        redis_version, local_generation = version or self.namespace_version(namespace)
+        if redis_version is not None and self.redis_available():
+            try:
+                self.redis.set(f"{self.prefix}:{namespace}:{redis_version}:{key}", json.dumps(value), ex=ttl)
+                return
+            except redis.RedisError as e:
+                self.redis_failed(e)
+        with self.stats_lock:
+            if self.local_generations.get(namespace, 0) == local_generation:
+                self.local.set(f"{namespace}:{key}", value, ttl)
+
+    def get_or_set(self, namespace, key, loader, ttl=None):
+        """
+        Return the cached value for key, computing and caching it with loader() on a miss.
+
+        :param namespace: Group of keys that are invalidated together.
+        :param key: Cache key within the namespace.
+        :param loader: Function without arguments returning a JSON-serializable value.
+        :param ttl: Time to live in seconds (default_ttl if not given).
+        """
+        # Read the version once: if the namespace is invalidated while loader() runs, the result is
+        # written under the old version instead of being cached as current
+        version = self.namespace_version(namespace)
+        found, value = self.get(namespace, key, version=version)
+        if found:
+            return value
+        value = loader()
+        self.set(namespace, key, value, ttl=ttl, version=version)
+        return value
+
+    def invalidate(self, *namespaces):
+        """
+        Drop every cached value of the given namespaces.
+
+        The local cache is always cleared as well, since it may have served requests while Redis
+        was down. If Redis itself cannot be reached, its entries expire after their TTL.
+        """
+        for namespace in namespaces:
+            with self.stats_lock:
+                self.local_generations[namespace] = self.local_generations.get(namespace, 0) + 1
+            self.local.delete_prefix(f"{namespace}:")
+            if self.redis_available():
+                try:
+                    self.redis.incr(self.version_key(namespace))
+                except redis.RedisError as e:
+                    self.redis_failed(e)
+
+    def stats(self):
+        """Hit and miss counters per namespace."""
+        with self.stats_lock:
+            return {
+                "backend": "redis" if self.redis_available() else "local",
+                "local_entries": len(self.local),
+                "redis_errors_total": self.redis_errors_total,
+                "namespaces": {namespace: dict(counters) for namespace, counters in self.counters.items()},
+            }
+
+    def close(self):
+        if self.redis is not None:
+            self.redis.close()
@@ -0,0 +1,160 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2 import extensions
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+QUERY_VERB = re.compile(r"^\s*(?:/\*\s*(?P<name>[\w.:-]+)\s*\*/\s*)?(?P<verb>\w+)\s*(?P<rest>.*)", re.DOTALL)
+QUERY_TABLE = re.compile(r"\b(?:FROM|INTO|TABLE|ON)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+
+def query_name(query):
+    """
+    Short, low-cardinality name of a statement for metrics: the name given in a leading
+    /* name */ comment, otherwise the verb and the first table, e.g. "select competitions".
+    """
+    if isinstance(query, bytes):
+        query = query[:512].decode("utf-8", "replace")
+    match = QUERY_VERB.match(str(query)[:512])
+    if match is None:
+        return "other"
+    if match.group("name"):
+        return match.group("name")
+    verb = match.group("verb").lower()
+    if verb == "update":
+        table = re.match(r"(\w+)", match.group("rest"))
+    else:
+        table = QUERY_TABLE.search(match.group("rest"))
+    return f"{verb} {table.group(1).lower()}" if table else verb
+
+
+def timed_cursor(on_query):
+    """Cursor class reporting (query name, seconds) of every execute to on_query."""
+    class TimedCursor(extensions.cursor):
+        def execute(self, query, vars=None):
+            started = time.perf_counter()
+            try:
+                return super().execute(query, vars)
+            finally:
+                on_query(query_name(query), time.perf_counter() - started)
+
+        def executemany(self, query, vars_list):
+            started = time.perf_counter()
+            try:
+                return super().executemany(query, vars_list)
+            finally:
+                on_query(query_name(query), time.perf_counter() - started)
+
+    return TimedCursor
+
+
+class DatabasePool:
+    def __init__(self, db_url, minconn=1, maxconn=10, acquire_timeout=30.0, on_query=None):
+        """
+        Shared pool of PostgreSQL connections.
+
+        Unlike a bare ThreadedConnectionPool, which raises PoolError as soon as maxconn
+        connections are checked out, callers wait up to acquire_timeout seconds for a free one.
+
+        :param db_url: PostgreSQL connection string.
+        :param minconn: Number of connections opened up front and kept open.
+        :param maxconn: Maximum number of simultaneously open connections.
+        :param acquire_timeout: Seconds to wait for a free connection before raising PoolError.
+        :param on_query: Optional callback(query name, seconds) called after every statement.
+        """
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        if on_query is not None:
+            self.pool = ThreadedConnectionPool(minconn, maxconn, db_url, cursor_factory=timed_cursor(on_query))
+        else:
+            self.pool = ThreadedConnectionPool(minconn, maxconn, db_url)
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.stats_lock = threading.Lock()
+        self.acquired_total = 0
+        self.waited_total = 0
+        self.timeouts_total = 0
+        self.errors_total = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.wait_seconds_total = 0.0
+
+    def acquire(self):
+        """Check out a connection, waiting for a free slot if the pool is exhausted."""
+        started = time.perf_counter()
+        waited = not self.slots.acquire(blocking=False)
+        if waited and not self.slots.acquire(timeout=self.acquire_timeout):
+            with self.stats_lock:
+                self.waited_total += 1
+                self.timeouts_total += 1
+            raise PoolError(f"No free database connection after {self.acquire_timeout} seconds")
+
+        try:
+            conn = self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+        with self.stats_lock:
+            self.acquired_total += 1
+            self.waited_total += int(waited)
+            self.wait_seconds_total += time.perf_counter() - started
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        return conn
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding it if it is broken."""
+        broken = bool(conn.closed)
+        if not broken and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            # Never hand out a connection with a half-finished transaction
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+        try:
+            self.pool.putconn(conn, close=broken)
+        finally:
+            with self.stats_lock:
+                self.in_use -= 1
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager yielding a pooled connection.
+
+        The caller commits explicitly; anything left uncommitted is rolled back when the
+        connection goes back to the pool, and an exception inside the block rolls back too.
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            with self.stats_lock:
+                self.errors_total += 1
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        """Pool usage metrics."""
+        with self.stats_lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "acquired_total": self.acquired_total,
+                "waited_total": self.waited_total,
+                "timeouts_total": self.timeouts_total,
+                "errors_total": self.errors_total,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+            }
+
+    def close(self):
+        """Close all pooled connections."""
+        self.pool.closeall()
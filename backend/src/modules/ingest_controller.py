@@ -0,0 +1,281 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from psycopg2.extras import execute_values
+from modules.rag_controller import COMPETITION_COLUMNS
+
+COLUMN_NAMES = [column.strip() for column in COMPETITION_COLUMNS.split(",")]
+
+
+class CompetitionIngestor:
+    def __init__(self, db_pool, table="competitions", on_conflict="update", page_size=1000):
+        """
+        Bulk loader for parsed competitions.
+
+        Rows are staged into a temporary table with execute_values and merged into the
+        target table with a single INSERT ... ON CONFLICT (ekp_number) statement.
+
+        :param db_pool: Shared DatabasePool.
+        :param table: Target table (the benchmark points this at a scratch copy).
+        :param on_conflict: "update" to overwrite changed rows, "nothing" to keep existing rows as they are.
+        :param page_size: Rows per multi-row INSERT sent to the staging table.
+        """
+        if on_conflict not in ("update", "nothing"):
+            raise ValueError(f"Unknown on_conflict mode: {on_conflict}")
+        self.db_pool = db_pool
+        self.table = table
+        self.on_conflict = on_conflict
+        self.page_size = page_size
+
+    @staticmethod
+    def normalize(entry):
+        """Coerce a parsed PDFParser tuple to the column types of the competitions table."""
+        entry = list(entry)
+        max_people_count = entry[9]
+        if isinstance(max_people_count, str):
+            max_people_count = max_people_count.strip()
+            entry[9] = int(max_people_count) if max_people_count.isdigit() else None
+        if isinstance(entry[10], str):
+            entry[10] = [entry[10]]  # genders_and_ages is a VARCHAR[] column
+        return tuple(entry)
+
+    def merge_sql(self):
+        columns = ", ".join(COLUMN_NAMES)
+        sql = f"""
+            INSERT INTO {self.table} ({columns})
+            SELECT DISTINCT ON (ekp_number) {columns}
+            FROM competitions_staging
+            WHERE ekp_number IS NOT NULL AND ekp_number <> ''
+            ORDER BY ekp_number
+        """
+        if self.on_conflict == "nothing":
+            sql += " ON CONFLICT (ekp_number) DO NOTHING"
+        else:
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMN_NAMES if column != "ekp_number")
+            current = ", ".join(f"{self.table}.{column}" for column in COLUMN_NAMES)
+            incoming = ", ".join(f"EXCLUDED.{column}" for column in COLUMN_NAMES)
+            sql += f" ON CONFLICT (ekp_number) DO UPDATE SET {updates} WHERE ({current}) IS DISTINCT FROM ({incoming})"
+        # xmax is 0 only for freshly inserted tuples, which tells inserts and updates apart
+        return sql + f" RETURNING (xmax = 0) AS inserted, {columns}"
+
+    def ingest(self, entries):
+        """
+        Load a batch of parsed competitions in one transaction.
+
+        :param entries: Iterable of PDFParser tuples.
+        :return: Dict with "inserted", "updated" and "skipped" counts, plus "inserted_rows" and
+                 "updated_rows" in COMPETITION_COLUMNS order (for updating the search index).
+        """
+        entries = [self.normalize(entry) for entry in entries]
+        result = {"inserted": 0, "updated": 0, "skipped": 0, "inserted_rows": [], "updated_rows": []}
+        if not entries:
+            return result
+
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            # Dates in the EKP calendar are written day first (DD.MM.YYYY)
+            cursor.execute("SET LOCAL datestyle = 'ISO, DMY'")
+            cursor.execute(f"""
+                CREATE TEMP TABLE competitions_staging ON COMMIT DROP AS
+                SELECT {COMPETITION_COLUMNS} FROM {self.table} WITH NO DATA
+            """)
+            execute_values(
+                cursor,
+                f"INSERT INTO competitions_staging ({COMPETITION_COLUMNS}) VALUES %s",
+                entries,
+                page_size=self.page_size
+            )
+            cursor.execute(self.merge_sql())
+            for row in cursor.fetchall():
+                if row[0]:
+                    result["inserted_rows"].append(tuple(row[1:]))
+                else:
+                    result["updated_rows"].append(tuple(row[1:]))
+            conn.commit()
+
+        result["inserted"] = len(result["inserted_rows"])
+        result["updated"] = len(result["updated_rows"])
+        result["skipped"] = len(entries) - result["inserted"] - result["updated"]
+        return result
+
+    def ingest_stream(self, entries, batch_size=500, on_batch=None):
+        """
+        Load competitions from an iterable (e.g. PDFParser.parse_iter) in fixed-size batches.
+
+        Each batch is committed on its own, so the first rows are in the database while the
+        rest of the document is still being parsed and at most batch_size rows are held in memory.
+
+        :param entries: Iterable of PDFParser tuples.
+        :param batch_size: Rows per transaction.
+        :param on_batch: Optional callback receiving the ingest() result of every batch.
+        :return: Dict with the total "inserted", "updated", "skipped" and "batches" counts.
+        """
+        totals = {"inserted": 0, "updated": 0, "skipped": 0, "batches": 0}
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            result = self.ingest(batch)
+            for key in ("inserted", "updated", "skipped"):
+                totals[key] += result[key]
+            totals["batches"] += 1
+            if on_batch is not None:
+                on_batch(result)
+        return totals
+
+
+JOB_COLUMNS = ["id", "filename", "content_hash", "status", "rows_parsed", "rows_inserted", "rows_updated",
+               "rows_skipped", "error", "created_at", "started_at", "finished_at"]
+
+
+class IngestJobManager:
+    def __init__(self, db_pool, process, workers=2):
+        """
+        Queue of PDF ingestion jobs with their state persisted in the ingest_jobs table.
+
+        :param db_pool: Shared DatabasePool.
+        :param process: Function (file_path, on_batch) doing the actual work and returning
+                        totals like CompetitionIngestor.ingest_stream.
+        :param workers: Number of jobs processed at the same time; each running job holds one pool
+                        connection for its claim lock.
+        """
+        self.db_pool = db_pool
+        self.process = process
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+
+    def submit(self, filename, file_path, content_hash):
+        """
+        Register an uploaded file and queue it for processing.
+
+        A file whose content hash was already uploaded is not processed again: the existing
+        job is returned instead, unless it failed, in which case it is retried.
+
+        :return: Tuple (job dict, created) where created is False for a deduplicated upload.
+        """
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO ingest_jobs (filename, content_hash, file_path)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (content_hash) DO UPDATE
+                SET status = 'queued', filename = EXCLUDED.filename, file_path = EXCLUDED.file_path,
+                    error = NULL, started_at = NULL, finished_at = NULL,
+                    rows_parsed = 0, rows_inserted = 0, rows_updated = 0, rows_skipped = 0,
+                    created_at = CURRENT_TIMESTAMP
+                WHERE ingest_jobs.status = 'failed'
+                RETURNING id
+            """, (filename, content_hash, file_path))
+            row = cursor.fetchone()
+            conn.commit()
+
+        if row is None:
+            return self.find(content_hash), False
+
+        self.executor.submit(self.run, row[0], file_path)
+        return self.get(row[0]), True
+
+    def resume(self):
+        """
+        Queue again the jobs that were queued or running when the application stopped.
+
+        Every worker process does this on startup; run() claims each job, so only one of them
+        processes it.
+        """
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id, file_path FROM ingest_jobs WHERE status IN ('queued', 'running') ORDER BY id")
+            jobs = cursor.fetchall()
+        for job_id, file_path in jobs:
+            self.executor.submit(self.run, job_id, file_path)
+
+    def run(self, job_id, file_path):
+        """
+        Claim one job and process it, recording progress after every batch.
+
+        A session advisory lock on the job id, held on a pooled connection until the job ends,
+        marks it as taken: a job that is "running" but not locked was interrupted and may be
+        claimed again. Jobs locked by another worker, or already finished, are skipped.
+        """
+        with self.db_pool.connection() as lock_conn:
+            with lock_conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(hashtext('cmse_ingest_job'), %s)", (job_id,))
+                locked = cursor.fetchone()[0]
+            lock_conn.commit()
+            if not locked:
+                return
+            try:
+                if self.claim(job_id):
+                    self.process_job(job_id, file_path)
+            finally:
+                with lock_conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext('cmse_ingest_job'), %s)", (job_id,))
+                lock_conn.commit()
+
+    def claim(self, job_id):
+        """Mark a queued or interrupted job as running, resetting its counters; False if it is not claimable."""
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE ingest_jobs
+                SET status = 'running', started_at = CURRENT_TIMESTAMP, finished_at = NULL, error = NULL,
+                    rows_parsed = 0, rows_inserted = 0, rows_updated = 0, rows_skipped = 0
+                WHERE id = %s AND status IN ('queued', 'running')
+                RETURNING id
+            """, (job_id,))
+            claimed = cursor.fetchone() is not None
+            conn.commit()
+        return claimed
+
+    def process_job(self, job_id, file_path):
+        if not file_path or not os.path.exists(file_path):
+            self.finish(job_id, "failed", error="Uploaded file is missing after restart.")
+            return
+
+        def on_batch(result):
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE ingest_jobs
+                    SET rows_parsed = rows_parsed + %s, rows_inserted = rows_inserted + %s,
+                        rows_updated = rows_updated + %s, rows_skipped = rows_skipped + %s
+                    WHERE id = %s
+                """, (result["inserted"] + result["updated"] + result["skipped"],
+                      result["inserted"], result["updated"], result["skipped"], job_id))
+                conn.commit()
+
+        try:
+            self.process(file_path, on_batch)
+        except Exception as e:
+            print(f"Ingest job {job_id} failed: {str(e)}")
+            self.finish(job_id, "failed", error=str(e))
+        else:
+            self.finish(job_id, "done")
+        finally:
+            # A failed upload is retried by uploading it again, so the file is not needed anymore
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def finish(self, job_id, status, error=None):
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE ingest_jobs SET status = %s, error = %s, finished_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (status, error, job_id)
+            )
+            conn.commit()
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if it does not exist."""
+        return self.fetch_job("id = %s", job_id)
+
+    def find(self, content_hash):
+        return self.fetch_job("content_hash = %s", content_hash)
+
+    def fetch_job(self, condition, value):
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM ingest_jobs WHERE {condition}", (value,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip(JOB_COLUMNS, row))
+        if job["started_at"] and job["finished_at"]:
+            job["duration_seconds"] = (job["finished_at"] - job["started_at"]).total_seconds()
+        return job
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,213 @@
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# (kind, name, milliseconds) of the SQL statements and stages run for the current request
+request_trace = ContextVar("request_trace", default=None)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        In-process counters, gauges and histograms rendered in the Prometheus text format.
+
+        Every metric is keyed by its name and a tuple of label values; recording takes one lock,
+        so it is cheap enough for every request and SQL statement.
+
+        :param buckets: Upper bounds (seconds) of the histogram buckets.
+        """
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.help = {}
+        self.types = {}
+        self.values = {}
+
+    def describe(self, name, kind, help_text):
+        self.types[name] = kind
+        self.help[name] = help_text
+
+    def inc(self, name, labels=None, value=1.0):
+        key = (name, tuple((labels or {}).items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def set(self, name, value, labels=None):
+        with self.lock:
+            self.values[(name, tuple((labels or {}).items()))] = value
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple((labels or {}).items()))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def observe_sql(self, query_name, seconds):
+        """Record one SQL statement (the on_query hook of DatabasePool)."""
+        self.observe("cmse_sql_query_duration_seconds", seconds, {"query": query_name})
+        trace = request_trace.get()
+        if trace is not None:
+            trace.append(("sql", query_name, round(seconds * 1000, 3)))
+
+    @contextmanager
+    def stage(self, name):
+        """Time a processing stage (PDF parse, vectorize, index build, search)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - started)
+
+    def observe_stage(self, name, seconds):
+        self.observe("cmse_stage_duration_seconds", seconds, {"stage": name})
+        trace = request_trace.get()
+        if trace is not None:
+            trace.append(("stage", name, round(seconds * 1000, 3)))
+
+    def timed_iter(self, name, iterable):
+        """Yield from iterable, recording the time spent producing items as one stage."""
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            self.observe_stage(name, elapsed)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            items = sorted(
+                ((key, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value)
+                 for key, value in self.values.items()),
+                key=lambda item: item[0][0]
+            )
+        lines = []
+        described = set()
+        for (name, labels), value in items:
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {self.types.get(name, 'untyped')}")
+            labels = dict(labels)
+            if not isinstance(value, list):
+                lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics, slow_threshold=1.0, slow_sample_rate=1.0):
+        """
+        ASGI middleware recording request counts, latency histograms per route and the number
+        of requests in flight.
+
+        Requests slower than slow_threshold seconds are logged (a slow_sample_rate fraction of
+        them) with the SQL statements and stages they ran.
+
+        :param metrics: Metrics registry.
+        :param slow_threshold: Seconds after which a request is slow (0 disables the log).
+        :param slow_sample_rate: Fraction of slow requests that are logged.
+        """
+        self.app = app
+        self.metrics = metrics
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.route_paths = None
+        metrics.describe("cmse_http_requests_total", "counter", "HTTP requests by route and status.")
+        metrics.describe("cmse_http_request_duration_seconds", "histogram", "HTTP request latency by route.")
+        metrics.describe("cmse_http_requests_in_flight", "gauge", "HTTP requests being handled.")
+        metrics.describe("cmse_sql_query_duration_seconds", "histogram", "SQL statement latency by query.")
+        metrics.describe("cmse_stage_duration_seconds", "histogram", "Processing stage latency.")
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+    def route_path(self, scope):
+        """Path template of the matched route, so labels do not grow with every id in a URL."""
+        route = scope.get("route")
+        if route is not None:
+            return route.path
+        endpoint = scope.get("endpoint")
+        if endpoint is None or "app" not in scope:
+            return "unmatched"
+        if self.route_paths is None:
+            self.route_paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+        return self.route_paths.get(endpoint, "unmatched")
+
+    def track_in_flight(self, delta):
+        with self.in_flight_lock:
+            self.in_flight += delta
+            self.metrics.set("cmse_http_requests_in_flight", self.in_flight)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        trace = []
+        token = request_trace.set(trace)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.track_in_flight(1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.track_in_flight(-1)
+            request_trace.reset(token)
+            route = self.route_path(scope)
+            labels = {"method": scope["method"], "route": route}
+            self.metrics.observe("cmse_http_request_duration_seconds", elapsed, labels)
+            self.metrics.inc("cmse_http_requests_total", {**labels, "status": status})
+            if self.slow_threshold and elapsed >= self.slow_threshold and random.random() < self.slow_sample_rate:
+                print("Slow request: " + json.dumps({
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route,
+                    "status": status,
+                    "ms": round(elapsed * 1000, 3),
+                    "timings": [{"kind": kind, "name": name, "ms": ms} for kind, name, ms in trace]
+                }, ensure_ascii=False))
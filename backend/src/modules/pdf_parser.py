@@ -1,9 +1,76 @@
+import multiprocessing
 import pdfplumber
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def extract_page_lines(page, threshold_distance, sport_names_text_height):
+    """
+    Собирает строки одной страницы и названия видов спорта, найденные на ней.
+
+    :param page: Страница pdfplumber.
+    :param threshold_distance: Минимальное расстояние между словами для их разделения.
+    :param sport_names_text_height: Высота текста названий видов спорта.
+    :return: Кортеж (строки страницы, названия видов спорта).
+    """
+    words = page.extract_words()
+    processed_lines = []
+    sport_names = []
+    current_line = []
+
+    for i in range(len(words)):
+        current_word = words[i]['text']
+        current_line.append(current_word)
+        if int(words[i]['height']) == sport_names_text_height:
+            spn = ""
+            spn += words[i]['text']
+            for j in range(1, 9):
+                if (i + j < len(words) and int(words[i + j]['height']) == sport_names_text_height and
+                        int(words[i - j]['height']) != sport_names_text_height):
+                    spn += " " + words[i + j]['text']
+                else:
+                    if int(words[i - j]['height']) != sport_names_text_height:
+                        sport_names.append(spn)
+                    break
+
+        if i < len(words) - 1:
+            distance = words[i + 1]['x0'] - words[i]['x1']
+            if distance > threshold_distance:
+                current_line.append('|')
+
+        if i == len(words) - 1 or words[i]['top'] != words[i + 1]['top']:
+            processed_line = ' '.join(current_line)
+            processed_lines.append(processed_line)
+            current_line = []
+
+    return processed_lines, sport_names
+
+
+def extract_pages(pdf_path, page_numbers, threshold_distance, sport_names_text_height):
+    """
+    Обрабатывает набор страниц в отдельном процессе (один pdfplumber.open на задачу).
+
+    :return: Список результатов extract_page_lines в порядке page_numbers.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        return [extract_and_close_page(pdf.pages[number], threshold_distance, sport_names_text_height) for number in page_numbers]
+
+
+def extract_and_close_page(page, threshold_distance, sport_names_text_height):
+    """
+    Извлекает строки страницы и освобождает разобранные объекты, которые pdfplumber иначе
+    хранит для каждой посещенной страницы до закрытия документа.
+    """
+    try:
+        return extract_page_lines(page, threshold_distance, sport_names_text_height)
+    finally:
+        page.close()
+
 
 class PDFParser:
     def __init__(self, threshold_distance=20, header_height=7, sport_names_text_height=12,
-                 sport_compositions_names=None):
+                 sport_compositions_names=None, workers=1, max_pages=None, pages_per_task=8):
         """
         Инициализация парсера PDF.
 
@@ -12,11 +79,137 @@ class PDFParser:
         :param header_height: Количество строк заголовка для пропуска (по умолчанию 7).
         :param sport_names_text_height: Высота текста названий видов спорта (по умолчанию 12).
         :param sport_compositions_names: Список названий составов спорта для поиска (по умолчанию ["Основной состав", "Молодежный (резервный) состав"]).
+        :param workers: Количество процессов для извлечения слов со страниц (по умолчанию 1 — без пула процессов).
+        :param max_pages: Максимальное количество обрабатываемых страниц (по умолчанию без ограничения).
+        :param pages_per_task: Количество страниц, которые процесс обрабатывает за одну задачу (по умолчанию 8).
         """
         self.threshold_distance = threshold_distance
         self.header_height = header_height
         self.sport_names_text_height = sport_names_text_height
         self.sport_compositions_names = sport_compositions_names or ["Основной состав", "Молодежный (резервный) состав"]
+        self.workers = workers
+        self.max_pages = max_pages
+        self.pages_per_task = pages_per_task
+
+    def iter_page_lines(self, pdf_path):
+        """
+        Извлекает строки страниц по порядку, при workers > 1 — параллельно в пуле процессов.
+
+        В пул отправляется не больше двух задач на процесс: следующие страницы берутся в работу
+        по мере того, как забираются готовые, а при закрытии генератора ожидающие задачи отменяются.
+
+        :return: Генератор кортежей (строки страницы, названия видов спорта).
+        """
+        with pdfplumber.open(pdf_path) as pdf:
+            page_count = len(pdf.pages)
+            if self.max_pages is not None:
+                page_count = min(page_count, self.max_pages)
+
+            if self.workers <= 1:
+                for page in pdf.pages[:page_count]:
+                    yield extract_and_close_page(page, self.threshold_distance, self.sport_names_text_height)
+                return
+
+        chunks = [list(range(start, min(start + self.pages_per_task, page_count)))
+                  for start in range(0, page_count, self.pages_per_task)]
+        # spawn: the parser is started from threads of the web server, where fork is unsafe
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        pending = deque()
+        chunks = iter(chunks)
+        try:
+            while True:
+                for pages in chunks:
+                    pending.append(pool.submit(
+                        extract_pages, pdf_path, pages, self.threshold_distance, self.sport_names_text_height
+                    ))
+                    if len(pending) >= 2 * self.workers:
+                        break
+                if not pending:
+                    break
+                # Chunks are taken in page order, so the state below carries across pages correctly
+                yield from pending.popleft().result()
+        finally:
+            # The caller may stop early (e.g. a failed batch); pages not started yet are dropped
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def parse_record(self, record):
+        """
+        Разбирает текст одной записи соревнования.
+
+        :param record: Строка записи (" | номер ЕКП | ... | вид спорта | состав").
+        :return: Кортеж с информацией о соревновании или None, если запись не разобрать.
+        """
+        try:
+            new = record.strip()[1:].split("|")
+            ekp_number = new[0].strip()
+            competition_class = new[1].strip()
+            date_start = new[2].strip()
+            country = new[3].strip()
+            max_people_count = new[4].strip()
+            genders_and_ages = new[5].strip()
+            date_end = new [6].strip()
+            city = new[7].strip()
+            discipline = " ".join([" ".join(x.strip().split("|")) for x in new[8:-2]])
+            sport_name = new[-2].strip()
+            sport_composition = new[-1].strip()
+        except Exception as e:
+            print("skip", e)
+            return None
+
+        return (sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, genders_and_ages)  # Вывод нужной информации
+
+    def parse_iter(self, pdf_path):
+        """
+        Парсит PDF файл и выдает соревнования по мере того, как каждая запись заканчивается.
+
+        Запись считается законченной, когда начинается следующая (новый номер ЕКП) или кончается
+        документ, поэтому в памяти хранится только текст текущей записи.
+
+        :return: Генератор кортежей с информацией о соревнованиях.
+        """
+        record = ""
+        sport_composition = "default"
+        sport_name = "default"
+        sport_names = []
+
+        for ind, (processed_lines, page_sport_names) in enumerate(self.iter_page_lines(pdf_path)):
+            sport_names.extend(page_sport_names)
+
+            if ind == 0:
+                processed_lines = processed_lines[self.header_height:]
+
+            for line in processed_lines:
+                if "Стр." in line:
+                    continue
+
+                line = line.strip()
+
+                if line == line.upper() and "|" not in line and line.strip() in sport_names:
+                    sport_name = line
+                    continue
+
+                if line in self.sport_compositions_names:
+                    sport_composition = line
+                    continue
+
+                if sport_composition != "default" and sport_name != "default":
+                    number_match = re.match(r'(\d{16})', line)
+                    if number_match:
+                        number = number_match.group(0)
+                        record += f" | {sport_name} | {sport_composition}"
+                        entry = self.parse_record(record)
+                        if entry is not None:
+                            yield entry
+                        record = f" | {number} | {line[len(number):].strip()}\n"
+                    else:
+                        record += f" | {line}\n"
+                        if line == processed_lines[-2]:
+                            record += f" {sport_name} | {sport_composition} "
+
+        entry = self.parse_record(record)
+        if entry is not None:
+            yield entry
 
     def parse(self, pdf_path):
         """
@@ -24,89 +217,4 @@ class PDFParser:
 
         :return: Список кортежей, содержащих извлеченную информацию о соревнованиях.
         """
-        with pdfplumber.open(pdf_path) as pdf:
-            final_string = ""
-            sport_composition = "default"
-            sport_name = "default"
-            sport_names = []
-            final_mas = []
-            
-            for ind, page in enumerate(pdf.pages[0:50]):  # Обработка первых 50 страниц
-                words = page.extract_words()
-                processed_lines = []
-                current_line = []
-                
-                for i in range(len(words)):
-                    current_word = words[i]['text']
-                    current_line.append(current_word)
-                    if int(words[i]['height']) == self.sport_names_text_height:
-                        spn = ""
-                        spn += words[i]['text']
-                        for j in range(1, 9):
-                            if (i + j < len(words) and int(words[i + j]['height']) == self.sport_names_text_height and
-                                    int(words[i - j]['height']) != self.sport_names_text_height):
-                                spn += " " + words[i + j]['text']
-                            else:
-                                if int(words[i - j]['height']) != self.sport_names_text_height:
-                                    sport_names.append(spn)
-                                break
-                    
-                    if i < len(words) - 1:
-                        distance = words[i + 1]['x0'] - words[i]['x1']
-                        if distance > self.threshold_distance:
-                            current_line.append('|')
-                    
-                    if i == len(words) - 1 or words[i]['top'] != words[i + 1]['top']:
-                        processed_line = ' '.join(current_line)
-                        processed_lines.append(processed_line)
-                        current_line = []
-                
-                if ind == 0:
-                    processed_lines = processed_lines[self.header_height:]
-
-                for line in processed_lines:
-                    if "Стр." in line:
-                        continue
-                    
-                    line = line.strip()
-
-                    if line == line.upper() and "|" not in line and line.strip() in sport_names:
-                        sport_name = line
-                        continue
-                    
-                    if line in self.sport_compositions_names:
-                        sport_composition = line
-                        continue
-                    
-                    if sport_composition != "default" and sport_name != "default":
-                        number_match = re.match(r'(\d{16})', line)
-                        if number_match:
-                            number = number_match.group(0)
-                            final_string += f" | {sport_name} | {sport_composition}\n\n\n"
-                            final_string += f" | {number} | {line[len(number):].strip()}\n"
-                        else:
-                            final_string += f" | {line}\n"
-                            if line == processed_lines[-2]:
-                                final_string += f" {sport_name} | {sport_composition} "
-
-        for line in final_string.strip().split("\n\n\n"):
-            try:
-                new = line.strip()[1:].split("|")
-                ekp_number = new[0].strip()
-                competition_class = new[1].strip()
-                date_start = new[2].strip()
-                country = new[3].strip()
-                max_people_count = new[4].strip()
-                genders_and_ages = new[5].strip()
-                date_end = new [6].strip()
-                city = new[7].strip()
-                discipline = " ".join([" ".join(x.strip().split("|")) for x in new[8:-2]])
-                sport_name = new[-2].strip()
-                sport_composition = new[-1].strip()
-            except Exception as e:
-                print("skip", e)
-                continue
-            
-            final_mas.append((sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, genders_and_ages))  # Вывод нужной информации
-        
-        return final_mas
\ No newline at end of file
+        return list(self.parse_iter(pdf_path))
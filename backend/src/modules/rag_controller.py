@@ -1,57 +1,574 @@
+import fcntl
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 import numpy as np
-import psycopg2
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 import faiss  # Facebook AI Similarity Search
 
+SEARCH_BACKENDS = ("faiss", "sparse")
+
+# "vector": in-memory TF-IDF index, "fulltext": PostgreSQL tsvector, "hybrid": blend of both scores
+SEARCH_MODES = ("vector", "fulltext", "hybrid")
+
+# Columns that are not kept in memory but can be fetched in bulk for search hits
+EXTRA_COLUMNS = ("id", "participants_count", "peoples", "comments")
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Snapshot directories are named "<time_ns>-<pid>"; anything else in snapshot_dir is ignored
+SNAPSHOT_NAME = re.compile(r"^(\d+)-(\d+)$")
+
+COMPETITION_COLUMNS = "sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, genders_and_ages"
+
+def fetch_extra_columns(db_pool, ekp_numbers, columns):
+    """Fetch the given columns for many competitions with a single query, keyed by ekp_number."""
+    for column in columns:
+        if column not in EXTRA_COLUMNS:
+            raise ValueError(f"Unknown competitions column: {column}")
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT ekp_number, {', '.join(columns)} FROM competitions WHERE ekp_number = ANY(%s)",
+            (list(ekp_numbers),)
+        )
+        return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+
 class CompetitionSearcher:
-    def __init__(self, db_url):
-        self.conn = psycopg2.connect(db_url)
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_pool, backend="faiss", metrics=None):
+        """
+        :param db_pool: Shared DatabasePool (None for a searcher whose data is filled by hand).
+        :param backend: "faiss" for a dense IndexFlatL2, "sparse" for cosine scoring directly
+                        on the CSR TF-IDF matrix (memory proportional to non-zeros).
+        :param metrics: Optional Metrics registry receiving vectorize/index_build/search timings.
+        """
+        if backend not in SEARCH_BACKENDS:
+            raise ValueError(f"Unknown search backend: {backend}")
+        self.backend = backend
+        self.db_pool = db_pool
+        self.metrics = metrics
         self.feature_vectors = None
         self.vectorizer = None
         self.index = None
+        self.postings = None
         self.data = None
+        # True while the arrays are read-only views of a snapshot on disk
+        self.mapped = False
+
+    def timed(self, stage):
+        return self.metrics.stage(stage) if self.metrics is not None else nullcontext()
 
     def fetch_competitions(self):
         """Fetch competitions data from the database."""
-        self.cursor.execute("SELECT sport_name, sport_composition, ekp_number, date_start, date_end, city, discipline, competition_class, country, max_people_count, genders_and_ages FROM competitions")
-        self.data = self.cursor.fetchall()
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"SELECT {COMPETITION_COLUMNS} FROM competitions")
+            self.data = cursor.fetchall()
 
     def create_feature_vectors(self):
-        """Create feature vectors using TF-IDF."""
+        """Create sparse (CSR) feature vectors using TF-IDF."""
         combined_data = [" ".join(map(str, entry)) for entry in self.data]
-        self.vectorizer = TfidfVectorizer()
-        self.feature_vectors = self.vectorizer.fit_transform(combined_data).toarray()
+        self.vectorizer = TfidfVectorizer(dtype=np.float32)
+        with self.timed("vectorize"):
+            self.feature_vectors = self.vectorizer.fit_transform(combined_data).tocsr()
 
     def build_index(self):
-        """Build a FAISS index for the feature vectors."""
-        d = self.feature_vectors.shape[1]  # Dimensionality of the vectors
-        self.index = faiss.IndexFlatL2(d)  # Index for searching using Euclidean distance
-        self.index.add(np.array(self.feature_vectors).astype('float32'))  # Add vectors to the index
+        """Build a FAISS index, or the term -> competitions inverted index for the sparse backend."""
+        with self.timed("index_build"):
+            if self.backend == "sparse":
+                self.postings = self.feature_vectors.T.tocsr()
+                return
+            d = self.feature_vectors.shape[1]  # Dimensionality of the vectors
+            self.index = faiss.IndexFlatL2(d)  # Index for searching using Euclidean distance
+            self.index.add(self.feature_vectors.toarray())  # Add vectors to the index
 
-    def search_competitions_by_keywords(self, keywords_str: str):
-        """Search competitions based on keywords."""
+    @property
+    def ready(self):
+        if self.backend == "sparse":
+            return self.postings is not None
+        return self.index is not None
+
+    def add_competitions(self, entries):
+        """Append new competitions to the existing vectors and index without refitting the vectorizer."""
+        entries = list(entries)
+        if not entries:
+            return
+        combined_data = [" ".join(map(str, entry)) for entry in entries]
+        with self.timed("vectorize"):
+            new_vectors = self.vectorizer.transform(combined_data).tocsr()
+        self.feature_vectors = sp.vstack([self.feature_vectors, new_vectors], format="csr")
+        if self.mapped:
+            # A memory-mapped FAISS index cannot grow; build a private copy from the vectors
+            self.build_index()
+            self.mapped = False
+        elif self.backend == "faiss":
+            self.index.add(new_vectors.toarray())
+        else:
+            self.postings = self.feature_vectors.T.tocsr()
+        self.data.extend(entries)
+
+    def save(self, path):
+        """
+        Write the searcher to a new directory at path: the fitted vectorizer and rows (pickle),
+        the CSR arrays of the vectors (and of the postings) as .npy files and the FAISS index,
+        all in formats that load() can memory-map.
+        """
+        os.makedirs(path)
+        matrices = {"vectors": self.feature_vectors}
+        if self.backend == "sparse":
+            matrices["postings"] = self.postings
+        for name, matrix in matrices.items():
+            for part in ("data", "indices", "indptr"):
+                np.save(os.path.join(path, f"{name}_{part}.npy"), getattr(matrix, part))
+        if self.backend == "faiss":
+            faiss.write_index(self.index, os.path.join(path, "index.faiss"))
+        with open(os.path.join(path, "state.pkl"), "wb") as f:
+            pickle.dump({"vectorizer": self.vectorizer, "data": self.data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({
+                "version": SNAPSHOT_FORMAT_VERSION,
+                "backend": self.backend,
+                "shapes": {name: list(matrix.shape) for name, matrix in matrices.items()}
+            }, f)
+
+    @classmethod
+    def load(cls, path, db_pool, metrics=None):
+        """
+        Load a searcher written by save(). The vectors, postings and FAISS index are mapped
+        read-only, so processes loading the same snapshot share one copy in the page cache.
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported search snapshot version: {meta.get('version')}")
+        searcher = cls(db_pool, backend=meta["backend"], metrics=metrics)
+        matrices = {
+            name: sp.csr_matrix(
+                tuple(np.load(os.path.join(path, f"{name}_{part}.npy"), mmap_mode="r")
+                      for part in ("data", "indices", "indptr")),
+                shape=tuple(shape), copy=False
+            )
+            for name, shape in meta["shapes"].items()
+        }
+        searcher.feature_vectors = matrices["vectors"]
+        searcher.postings = matrices.get("postings")
+        if searcher.backend == "faiss":
+            # IO_FLAG_MMAP_IFC maps flat indexes without copying; older FAISS only knows IO_FLAG_MMAP
+            flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            searcher.index = faiss.read_index(os.path.join(path, "index.faiss"), flag | faiss.IO_FLAG_READ_ONLY)
+        with open(os.path.join(path, "state.pkl"), "rb") as f:
+            state = pickle.load(f)
+        searcher.vectorizer = state["vectorizer"]
+        searcher.data = state["data"]
+        searcher.mapped = True
+        return searcher
+
+    def search_vectors(self, query_vectors, k):
+        """
+        Find the k nearest competitions for each query row.
+
+        :param query_vectors: Sparse TF-IDF matrix of queries (one row per query).
+        :return: (distances, indices) arrays of shape (n_queries, k); missing hits have index -1.
+                 Distances are squared L2 between the normalized vectors for both backends.
+        """
+        if self.backend == "faiss":
+            return self.index.search(query_vectors.toarray(), k)
+
+        # TF-IDF rows are L2-normalized, so cosine similarity is a plain sparse dot product;
+        # multiplying by the inverted index only touches the postings of the query terms, and the
+        # product stays sparse: each query row holds only the competitions sharing a term with it
+        scores = (query_vectors @ self.postings).tocsr()
+        n_queries = scores.shape[0]
+        indices = np.full((n_queries, k), -1, dtype=np.int64)
+        distances = np.full((n_queries, k), np.inf, dtype=np.float32)
+        for query in range(n_queries):
+            start, end = scores.indptr[query], scores.indptr[query + 1]
+            row_scores, row_indices = scores.data[start:end], scores.indices[start:end]
+            top = min(k, end - start)
+            if top == 0:
+                continue
+            candidates = np.argpartition(-row_scores, top - 1)[:top]
+            # Best score first, ties by row number
+            order = candidates[np.lexsort((row_indices[candidates], -row_scores[candidates]))]
+            indices[query, :top] = row_indices[order]
+            distances[query, :top] = 2.0 - 2.0 * row_scores[order]
+        return distances, indices
+
+    @staticmethod
+    def build_query(keywords_str: str):
+        """Turn a comma-separated keywords string into a query string (empty if there are no keywords)."""
         keywords = [keyword.strip() for keyword in keywords_str.split(',') if keyword.strip()]
-        
-        if not keywords:
+        return " ".join(keywords)
+
+    def search_competitions_by_keywords(self, keywords_str: str, k=5, extra_columns=None):
+        """Search competitions based on keywords."""
+        if not self.build_query(keywords_str):
             print("No keywords provided for search.")
             return []
+        return self.search_many([keywords_str], k=k, extra_columns=extra_columns)[0]
 
-        query_str = " ".join(keywords)
-        query_vector = self.vectorizer.transform([query_str]).toarray().astype('float32')
+    def search_many(self, keywords_strs, k=5, extra_columns=None):
+        """
+        Search competitions for many keyword strings at once.
 
-        k = 5  # Number of nearest neighbors
-        distances, indices = self.index.search(query_vector, k)
+        All queries are vectorized with a single transform call and searched with a single
+        index lookup. Rows come straight from the in-memory data; the database is only
+        queried (once for the whole batch) when extra_columns are requested.
 
-        results = []
-        for idx in indices[0]:
-            if idx != -1:  # Check if the index is valid
-                self.cursor.execute("SELECT * FROM competitions WHERE ekp_number = %s", (self.data[idx][2],))  # Use ekp_number to get full information
-                results.append(self.cursor.fetchone())
+        :param keywords_strs: List of comma-separated keyword strings.
+        :param k: Number of nearest neighbors per query.
+        :param extra_columns: Optional list of competitions columns to append to each row.
+        :return: One list of (row, score) pairs per keyword string, in the same order.
+                 The score is the cosine similarity between the query and the competition.
+        """
+        queries = [self.build_query(keywords_str) for keywords_str in keywords_strs]
+        results = [[] for _ in queries]
+        active = [i for i, query in enumerate(queries) if query]
+        if not active:
+            return results
+
+        with self.timed("vectorize"):
+            query_vectors = self.vectorizer.transform([queries[i] for i in active])
+        # A query made only of words outside the vocabulary has a zero vector; every row would be
+        # at distance 1 from it (score 0.5), so such queries find nothing
+        nonzero = np.diff(query_vectors.indptr) > 0
+        active = [i for i, has_terms in zip(active, nonzero) if has_terms]
+        if not active:
+            return results
+        query_vectors = query_vectors[nonzero]
+        with self.timed("search"):
+            distances, indices = self.search_vectors(query_vectors, k)
+
+        extras = None
+        if extra_columns:
+            extras = self.fetch_extra_columns(
+                {self.data[idx][2] for row in indices for idx in row if idx != -1}, extra_columns
+            )
+
+        for position, i in enumerate(active):
+            for idx, distance in zip(indices[position], distances[position]):
+                score = float(1.0 - distance / 2.0)
+                # Rows sharing no term with the query (up to float32 rounding) are not matches
+                if idx == -1 or score <= 1e-6:
+                    continue
+                row = self.data[idx]
+                if extras is not None:
+                    row = tuple(row) + extras.get(row[2], (None,) * len(extra_columns))
+                results[i].append((row, score))
 
         return results
 
+    def fetch_extra_columns(self, ekp_numbers, columns):
+        return fetch_extra_columns(self.db_pool, ekp_numbers, columns)
+
+
+class FullTextSearcher:
+    def __init__(self, db_pool, config="russian"):
+        """
+        Keyword search done by PostgreSQL over the generated competitions.search_vector column.
+
+        Nothing is kept in memory: matching uses the GIN index on search_vector and the rows
+        are ranked with ts_rank, so any worker can search without loading the table.
+
+        :param db_pool: Shared DatabasePool.
+        :param config: Text search configuration the search_vector column is built with.
+        """
+        self.db_pool = db_pool
+        self.config = config
+
+    @staticmethod
+    def build_query(keywords_str: str):
+        """
+        Turn a comma-separated keywords string into a to_tsquery string matching any of its words
+        (empty if there are no words). Only word characters are kept, so the result is always valid.
+        """
+        return " | ".join(re.findall(r"\w+", keywords_str))
+
+    def search_many(self, keywords_strs, k=5, extra_columns=None):
+        """
+        Search competitions for many keyword strings with a single query.
+
+        :return: One list of (row, score) pairs per keyword string, in the same order, like
+                 CompetitionSearcher.search_many. The score is ts_rank scaled to [0, 1).
+        """
+        columns = list(extra_columns or [])
+        for column in columns:
+            if column not in EXTRA_COLUMNS:
+                raise ValueError(f"Unknown competitions column: {column}")
+        queries = [self.build_query(keywords_str) for keywords_str in keywords_strs]
+        results = [[] for _ in queries]
+        if not any(queries):
+            return results
+
+        selected = ", ".join(f"c.{column.strip()}" for column in COMPETITION_COLUMNS.split(",") + columns)
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                /* fulltext_search */
+                SELECT q.position, hit.*
+                FROM unnest(%s::text[]) WITH ORDINALITY AS q(text, position)
+                CROSS JOIN LATERAL (
+                    SELECT {selected}, ts_rank(c.search_vector, query, 32) AS score
+                    FROM competitions c, to_tsquery(%s::regconfig, q.text) AS query
+                    WHERE c.search_vector @@ query
+                    ORDER BY score DESC
+                    LIMIT %s
+                ) hit
+                WHERE q.text <> ''
+                ORDER BY q.position, hit.score DESC
+            """, (queries, self.config, k))
+            for row in cursor.fetchall():
+                results[row[0] - 1].append((tuple(row[1:-1]), float(row[-1])))
+        return results
+
+
+class SearchIndexService:
+    """
+    Long-lived competition search index shared by all requests.
+
+    The index is built once (usually at application startup) and then kept up to date
+    with add_competitions() as new rows are ingested. New rows are projected onto the
+    vocabulary fitted at build time; once the number of rows added since the last fit
+    exceeds refit_ratio of the fitted corpus, the vectorizer is refitted from the database.
+
+    Searches run in one of SEARCH_MODES, chosen per call or by the default mode. With the
+    "fulltext" default the in-memory index is not built at all; vector and hybrid searches
+    then fall back to full-text search.
+    """
+
+    def __init__(self, db_pool, backend="faiss", refit_ratio=0.5, mode="vector", hybrid_weight=0.5,
+                 fulltext_config="russian", snapshot_dir=None, reload_interval=10.0, keep_snapshots=2,
+                 metrics=None):
+        """
+        :param mode: Default search mode, one of SEARCH_MODES.
+        :param hybrid_weight: Weight of the vector score in hybrid mode (the rest goes to ts_rank).
+        :param fulltext_config: Text search configuration of competitions.search_vector.
+        :param snapshot_dir: Directory for index snapshots shared by all workers (None disables them).
+                             Every build or ingestion writes a new versioned snapshot and points
+                             the CURRENT file at it; workers memory-map the current snapshot.
+                             Publishing is serialized across processes by a lock file, and the
+                             rows a worker added since its last publish are carried over when it
+                             loads another worker's snapshot.
+        :param reload_interval: Seconds between checks for a newer snapshot written by another worker.
+        :param keep_snapshots: Number of snapshot versions kept on disk.
+        :param metrics: Optional Metrics registry passed to the searchers.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        self.db_pool = db_pool
+        self.backend = backend
+        self.refit_ratio = refit_ratio
+        self.mode = mode
+        self.hybrid_weight = hybrid_weight
+        self.fulltext = FullTextSearcher(db_pool, config=fulltext_config)
+        self.snapshot_dir = snapshot_dir
+        self.reload_interval = reload_interval
+        self.keep_snapshots = keep_snapshots
+        self.metrics = metrics
+        self.snapshot_version = None
+        self.checked_at = 0.0
+        self.searcher = None
+        self.fitted_count = 0
+        self.added_count = 0
+        # Rows added by this worker that are not in a published snapshot yet
+        self.unpublished = []
+        self.lock = threading.RLock()
+
+    def build(self):
+        """Fetch all competitions and build the vectors and the FAISS index from scratch."""
+        if self.mode == "fulltext":
+            return
+        searcher = CompetitionSearcher(self.db_pool, backend=self.backend, metrics=self.metrics)
+        searcher.fetch_competitions()
+        if searcher.data:
+            searcher.create_feature_vectors()
+            searcher.build_index()
+
+        with self.lock:
+            self.searcher = searcher
+            self.fitted_count = len(searcher.data)
+            self.added_count = 0
+            self.unpublished = []
+        # The rebuilt index already holds every committed row, so it replaces newer snapshots
+        self.save_snapshot(merge=False)
+
+    def current_snapshot(self):
+        """Version named in snapshot_dir/CURRENT, or None when there is no snapshot yet."""
+        try:
+            with open(os.path.join(self.snapshot_dir, "CURRENT")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def publish_lock(self):
+        """Exclusive lock on snapshot_dir, so one worker (or thread) at a time publishes a snapshot."""
+        os.makedirs(self.snapshot_dir, mode=0o700, exist_ok=True)
+        with open(os.path.join(self.snapshot_dir, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save_snapshot(self, merge=True):
+        """
+        Write the current index as a new snapshot version and make it the current one.
+
+        :param merge: If another worker has published since this one loaded, load its snapshot
+                      first (keeping this worker's unpublished rows), so its rows are not dropped.
+        """
+        if not self.snapshot_dir:
+            return
+        with self.publish_lock():
+            if merge and self.current_snapshot() != self.snapshot_version:
+                self.load_snapshot()
+            with self.lock:
+                if not self.ready:
+                    return
+                version = f"{time.time_ns()}-{os.getpid()}"
+                # Written under a temporary name, so a worker never maps a half-written snapshot
+                temp_path = os.path.join(self.snapshot_dir, f".{version}.tmp")
+                self.searcher.save(temp_path)
+                with open(os.path.join(temp_path, "counts.json"), "w") as f:
+                    json.dump({"fitted": self.fitted_count, "added": self.added_count}, f)
+                os.rename(temp_path, os.path.join(self.snapshot_dir, version))
+                self.snapshot_version = version
+                self.unpublished = []
+
+            with tempfile.NamedTemporaryFile("w", dir=self.snapshot_dir, prefix=".CURRENT.", delete=False) as temp_file:
+                temp_file.write(version)
+            os.replace(temp_file.name, os.path.join(self.snapshot_dir, "CURRENT"))
+
+            # Old versions may still be mapped by other workers; unlinking them keeps those mappings valid
+            versions = sorted(
+                (name for name in os.listdir(self.snapshot_dir) if SNAPSHOT_NAME.match(name)),
+                key=lambda name: int(SNAPSHOT_NAME.match(name).group(1))
+            )
+            for name in versions[:-self.keep_snapshots]:
+                shutil.rmtree(os.path.join(self.snapshot_dir, name), ignore_errors=True)
+
+    def load_snapshot(self):
+        """Map the current snapshot if it is newer than the loaded index; returns True if one is loaded."""
+        if not self.snapshot_dir or self.mode == "fulltext":
+            return False
+        version = self.current_snapshot()
+        if version is None or not SNAPSHOT_NAME.match(version):
+            return False
+        if version == self.snapshot_version:
+            return True
+        # Snapshots are unpickled, so only trust a directory no other user can write to
+        stat = os.stat(self.snapshot_dir)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise ValueError(f"Search snapshot directory {self.snapshot_dir} is writable by other users")
+        path = os.path.join(self.snapshot_dir, version)
+        searcher = CompetitionSearcher.load(path, self.db_pool, metrics=self.metrics)
+        if searcher.backend != self.backend:
+            return False
+        with open(os.path.join(path, "counts.json")) as f:
+            counts = json.load(f)
+        with self.lock:
+            # Rows this worker added but has not published yet are missing from the snapshot
+            known = {row[2] for row in searcher.data}
+            pending = [row for row in self.unpublished if row[2] not in known]
+            if pending:
+                searcher.add_competitions(pending)
+            self.searcher = searcher
+            self.fitted_count = counts["fitted"]
+            self.added_count = counts["added"] + len(pending)
+            self.snapshot_version = version
+        return True
+
+    def reload_if_stale(self):
+        """Pick up a snapshot written by another worker, checking at most every reload_interval seconds."""
+        if not self.snapshot_dir or time.monotonic() - self.checked_at < self.reload_interval:
+            return
+        self.checked_at = time.monotonic()
+        if self.current_snapshot() != self.snapshot_version:
+            try:
+                self.load_snapshot()
+            except (OSError, ValueError) as e:
+                print(f"Error loading search snapshot: {str(e)}")
+
+    @property
+    def ready(self):
+        return self.searcher is not None and self.searcher.ready
+
+    def add_competitions(self, entries):
+        """
+        Add freshly inserted competitions to the index.
+
+        :param entries: Rows in the same column order as CompetitionSearcher.fetch_competitions.
+        """
+        entries = list(entries)
+        if not entries or self.mode == "fulltext":
+            return
+
+        with self.lock:
+            if not self.ready:
+                needs_rebuild = True
+            else:
+                self.searcher.add_competitions(entries)
+                self.added_count += len(entries)
+                if self.snapshot_dir:
+                    self.unpublished.extend(entries)
+                needs_rebuild = self.added_count > self.refit_ratio * max(self.fitted_count, 1)
+
+        if needs_rebuild:
+            self.build()
+
+    def search(self, keywords_str: str, k=5, extra_columns=None, mode=None):
+        """Search competitions based on keywords using the shared index."""
+        if not CompetitionSearcher.build_query(keywords_str):
+            return []
+        return self.search_many([keywords_str], k=k, extra_columns=extra_columns, mode=mode)[0]
+
+    def search_many(self, keywords_strs, k=5, extra_columns=None, mode=None):
+        """
+        Search competitions for many keyword strings using the shared index, PostgreSQL
+        full-text search or both.
+
+        :param mode: One of SEARCH_MODES; defaults to the mode of the service.
+        """
+        mode = mode or self.mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        if mode != "fulltext":
+            self.reload_if_stale()
+            # Only the in-memory lookup needs the lock; the extra columns come from the database after it
+            with self.lock:
+                vector_results = self.searcher.search_many(keywords_strs, k=k) if self.ready else None
+            if vector_results is not None and extra_columns:
+                vector_results = self.with_extra_columns(vector_results, extra_columns)
+            if vector_results is not None and mode == "vector":
+                return vector_results
+        if mode == "fulltext" or vector_results is None:
+            return self.fulltext.search_many(keywords_strs, k=k, extra_columns=extra_columns)
+
+        fulltext_results = self.fulltext.search_many(keywords_strs, k=k, extra_columns=extra_columns)
+        return [self.blend(vector, fulltext, k) for vector, fulltext in zip(vector_results, fulltext_results)]
+
+    def with_extra_columns(self, results, extra_columns):
+        """Append the extra columns to the rows of search_many results, with one query for all of them."""
+        extras = fetch_extra_columns(self.db_pool, {row[2] for hits in results for row, _ in hits}, extra_columns)
+        missing = (None,) * len(extra_columns)
+        return [[(tuple(row) + extras.get(row[2], missing), score) for row, score in hits] for hits in results]
+
+    def blend(self, vector_hits, fulltext_hits, k):
+        """Merge two hit lists by ekp_number, scoring each row with the weighted sum of both scores."""
+        rows, scores = {}, {}
+        for hits, weight in ((vector_hits, self.hybrid_weight), (fulltext_hits, 1.0 - self.hybrid_weight)):
+            for row, score in hits:
+                rows.setdefault(row[2], row)
+                scores[row[2]] = scores.get(row[2], 0.0) + weight * score
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [(rows[ekp_number], scores[ekp_number]) for ekp_number in ranked]
+
     def close(self):
-        """Close the database connection."""
-        self.cursor.close()
-        self.conn.close()
+        with self.lock:
+            self.searcher = None
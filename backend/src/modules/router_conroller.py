@@ -1,65 +1,351 @@
-import requests
+import asyncio
+import time
 
-class TravelService:
-    def __init__(self, token=None):
+import httpx
+
+from modules.cache_controller import CacheManager
+
+HOTELLOOK_URL = "https://engine.hotellook.com"
+TUTU_URL = "https://suggest.travelpayouts.com"
+YANDEX_RASP_URL = "https://api.rasp.yandex.net"
+NOT_CONFIGURED = "Сервисы ещё не настроены"
+
+
+class ProviderError(Exception):
+    """Поставщик ответил, но ответ нельзя использовать (такие ответы не кэшируются)."""
+
+
+class TravelProvider:
+    """
+    Источник цен для /travel_info.
+
+    Подкласс задает name, kind ("hotel" или "transport") и реализует fetch(client, query), где query —
+    словарь с ключами departure_city, arrival_city, check_in, check_out, adults и currency.
+    """
+    name = None
+    kind = None
+
+    def __init__(self, base_url, timeout=10.0, cache_ttl=900):
         """
-        Инициализация сервиса путешествий.
-        
+        :param base_url: Адрес API (можно указать локальную заглушку для тестов).
+        :param timeout: Время в секундах, после которого ответ поставщика больше не ждут.
+        :param cache_ttl: Время жизни ответа в кэше в секундах.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+
+    def cache_key(self, query):
+        """Ключ кэша для запроса; None — ответ не кэшируется."""
+        return None
+
+    async def fetch(self, client, query):
+        raise NotImplementedError
+
+
+class HotellookProvider(TravelProvider):
+    name = "hotellook"
+    kind = "hotel"
+
+    def __init__(self, token=None, base_url=HOTELLOOK_URL, timeout=10.0, cache_ttl=900, limit=10):
+        """
+        Цены на проживание в отелях от Hotellook.
+
         :param token: Ваш партнерский токен (если есть).
+        :param limit: Количество отелей (по умолчанию 10).
         """
+        super().__init__(base_url, timeout=timeout, cache_ttl=cache_ttl)
         self.token = token
+        self.limit = limit
+
+    def cache_key(self, query):
+        return (query["arrival_city"].strip().lower(), query["check_in"], query["check_out"],
+                int(query["adults"]), query["currency"], self.limit)
 
-    def get_hotel_price(self, location, check_in, check_out, currency='rub', adults=2, limit=10):
+    async def fetch(self, client, query):
         """
-        Получает информацию о ценах на проживание в отелях в указанном городе.
+        Получает информацию о ценах на проживание в отелях в городе назначения.
 
-        :param location: Имя локации (город).
-        :param check_in: Дата заселения (в формате YYYY-MM-DD).
-        :param check_out: Дата выселения (в формате YYYY-MM-DD).
-        :param currency: Валюта ответа (по умолчанию 'rub').
-        :param adults: Количество гостей (по умолчанию 2).
-        :param limit: Количество отелей (по умолчанию 10).
-        :return: Ответ от API с информацией о ценах на отели.
+        :return: Средняя цена или сообщение о том, что отелей нет.
         """
-        url = "https://engine.hotellook.com/api/v2/cache.json"
-        
         # Параметры запроса
         params = {
-            'location': location,
-            'checkIn': check_in,
-            'checkOut': check_out,
-            'currency': currency,
-            'adults': adults,
-            'limit': limit
+            'location': query["arrival_city"],
+            'checkIn': query["check_in"],
+            'checkOut': query["check_out"],
+            'currency': query["currency"],
+            'adults': query["adults"],
+            'limit': self.limit
         }
-        
+
         if self.token:
             params['token'] = self.token
 
-        # Выполнение запроса
-        response = requests.get(url, params=params)
+        response = await client.get(f"{self.base_url}/api/v2/cache.json", params=params, timeout=self.timeout)
         # Проверка на успешный ответ
-        if response.status_code == 200:
-            hotels = response.json()
-            if hotels:
-                average_price = sum(hotel['priceAvg'] for hotel in hotels) / len(hotels)
-                return average_price
-            else:
-                return "Нет доступных отелей."
-        else:
-            return f"Ошибка при запросе: {response.status_code} - {response.text}"
+        if response.status_code != 200:
+            raise ProviderError(f"Ошибка при запросе: {response.status_code} - {response.text}")
+        hotels = response.json()
+        if not hotels:
+            return "Нет доступных отелей."
+        return sum(hotel['priceAvg'] for hotel in hotels) / len(hotels)
+
 
-    def get_transport_price(self, from_station, to_station, check_out, api_key):
+class TutuProvider(TravelProvider):
+    name = "tutu"
+    kind = "transport"
+
+    def __init__(self, station_resolver, base_url=TUTU_URL, timeout=10.0, cache_ttl=900):
+        """
+        Цены на поезда от Туту.ру (через travelpayouts).
+
+        :param station_resolver: Функция, возвращающая код станции Туту по названию города или None.
+        """
+        super().__init__(base_url, timeout=timeout, cache_ttl=cache_ttl)
+        self.station_resolver = station_resolver
+
+    def cache_key(self, query):
+        # Туту отдает расписание без привязки к дате
+        return (query["departure_city"].strip().lower(), query["arrival_city"].strip().lower())
+
+    def resolve(self, city):
+        code = self.station_resolver(city)
+        if code is None:
+            raise ProviderError(f"Станция '{city}' не найдена.")
+        return code
+
+    async def fetch(self, client, query):
+        """
+        Получает минимальную цену билета на поезд между городами.
+
+        :return: Минимальная цена или сообщение о том, что поездов нет.
+        """
+        params = {
+            'service': 'tutu_trains',
+            'term': self.resolve(query["departure_city"]),
+            'term2': self.resolve(query["arrival_city"])
+        }
+        response = await client.get(f"{self.base_url}/search", params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"Ошибка при запросе: {response.status_code} - {response.text}")
+        data = response.json()
+        trips = data.get('trips', []) if data else []
+        prices = [category['price'] for trip in trips for category in trip.get('categories', [])]
+        if not prices:
+            return "Нет доступных поездов."
+        return min(prices)
+
+
+class YandexRaspProvider(TravelProvider):
+    name = "yandex_rasp"
+    kind = "transport"
+
+    def __init__(self, api_key, station_resolver=None, code_system="yandex", base_url=YANDEX_RASP_URL, timeout=10.0,
+                 cache_ttl=900):
+        """
+        Цены на рейсы из Яндекс Расписаний.
+
+        :param api_key: Ключ доступа к API Яндекс Расписаний.
+        :param station_resolver: Функция, возвращающая код станции по названию города или None.
+                                 Без нее города передаются как есть (например, "c213").
+        :param code_system: Система кодирования станций, которые возвращает station_resolver
+                            ("yandex", "express", "esr" и т.д.; коды Туту - это коды "express").
+        """
+        super().__init__(base_url, timeout=timeout, cache_ttl=cache_ttl)
+        self.api_key = api_key
+        self.station_resolver = station_resolver
+        self.code_system = code_system
+
+    def cache_key(self, query):
+        return (query["departure_city"].strip().lower(), query["arrival_city"].strip().lower(), query["check_in"])
+
+    def resolve(self, city):
+        if self.station_resolver is None:
+            return city
+        code = self.station_resolver(city)
+        if code is None:
+            raise ProviderError(f"Станция '{city}' не найдена.")
+        return code
+
+    async def fetch(self, client, query):
+        """
+        Получает минимальную стоимость перемещения в день заселения.
+
+        :return: Минимальная цена или сообщение о том, что рейсов нет.
+        """
+        # Параметры запроса
+        params = {
+            'apikey': self.api_key,
+            'format': 'json',
+            'from': self.resolve(query["departure_city"]),
+            'to': self.resolve(query["arrival_city"]),
+            'date': query["check_in"],
+            'system': self.code_system,
+            'lang': 'ru_RU',
+            'limit': 10  # Ограничение на количество рейсов
+        }
+        response = await client.get(f"{self.base_url}/v3.0/search/", params=params, timeout=self.timeout)
+        if response.status_code != 200:
+            raise ProviderError(f"Ошибка при запросе: {response.status_code} - {response.text}")
+        prices = [
+            place['price']['whole']
+            for trip in response.json().get('segments', [])
+            for place in (trip.get('tickets_info') or {}).get('places', [])
+        ]
+        if not prices:
+            return "Нет доступных рейсов."
+        return min(prices)
+
+
+class TravelService:
+    def __init__(self, providers=None, cache=None, pool_size=10):
+        """
+        Инициализация сервиса путешествий.
+
+        Все поставщики опрашиваются одновременно через один асинхронный HTTP клиент, у каждого свой
+        таймаут, поэтому ответ приходит не позже самого долгого таймаута, а не через их сумму.
+        Успешные ответы кэшируются, одинаковые одновременные запросы к поставщику выполняются один раз.
+
+        :param providers: Список TravelProvider (по умолчанию только Hotellook).
+        :param cache: CacheManager для ответов поставщиков (по умолчанию — кэш в памяти процесса).
+        :param pool_size: Количество HTTP соединений, которые держит клиент.
+        """
+        self.providers = providers if providers is not None else [HotellookProvider()]
+        self.cache = cache or CacheManager()
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = None
+        self.client_loop = None
+        self.inflight = {}
+
+    def get_client(self):
+        # The client's connections belong to the event loop it was first used on
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.client_loop is not loop:
+            self.client = httpx.AsyncClient(limits=self.limits)
+            self.client_loop = loop
+        return self.client
+
+    async def single_flight(self, key, func):
+        """
+        Выполняет func() один раз для всех одновременных вызовов с одинаковым ключом.
+
+        Запрос выполняется отдельной задачей: если один из ожидающих отвалился по таймауту,
+        остальные продолжают ждать, а результат все равно попадет в кэш.
+        """
+        task = self.inflight.get(key)
+        if task is None or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(func())
+            self.inflight[key] = task
+
+            def done(finished):
+                if self.inflight.get(key) is finished:
+                    del self.inflight[key]
+                if not finished.cancelled():
+                    finished.exception()  # Nobody may be waiting anymore; do not warn about it
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def fetch_provider(self, provider, query):
+        key = provider.cache_key(query)
+        if key is None:
+            return await provider.fetch(self.get_client(), query)
+
+        key = (provider.name,) + key
+        found, value = await asyncio.to_thread(self.cache.get, "travel_prices", key)
+        if found:
+            return value
+        return await self.single_flight(key, lambda: self.fetch_and_cache(provider, query, key))
+
+    async def fetch_and_cache(self, provider, query, key):
+        value = await provider.fetch(self.get_client(), query)
+        await asyncio.to_thread(self.cache.set, "travel_prices", key, value, provider.cache_ttl)
+        return value
+
+    async def run_provider(self, provider, query):
+        """Опрашивает одного поставщика; ошибки и таймауты возвращаются как его статус."""
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self.fetch_provider(provider, query), provider.timeout)
+            status = {"status": "ok", "result": result}
+        except asyncio.TimeoutError:
+            status = {"status": "timeout", "error": f"Нет ответа за {provider.timeout} с."}
+        except Exception as e:
+            status = {"status": "error", "error": str(e)}
+        status["kind"] = provider.kind
+        status["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return provider.name, status
+
+    async def collect(self, query, kind=None):
+        providers = [provider for provider in self.providers if kind is None or provider.kind == kind]
+        return dict(await asyncio.gather(*(self.run_provider(provider, query) for provider in providers)))
+
+    def best_price(self, results, kind):
+        """Минимальная цена среди ответивших поставщиков, иначе их сообщение."""
+        if not any(provider.kind == kind for provider in self.providers):
+            return NOT_CONFIGURED
+        answers = [status["result"] for status in results.values() if status["kind"] == kind and status["status"] == "ok"]
+        prices = [answer for answer in answers if isinstance(answer, (int, float))]
+        if prices:
+            return min(prices)
+        return answers[0] if answers else None
+
+    @staticmethod
+    def make_query(departure_city, arrival_city, check_in, check_out, adults=2, currency='rub'):
+        return {
+            "departure_city": departure_city,
+            "arrival_city": arrival_city,
+            "check_in": check_in,
+            "check_out": check_out,
+            "adults": adults,
+            "currency": currency
+        }
+
+    async def get_travel_info(self, departure_city, arrival_city, check_in, check_out, adults=2, currency='rub'):
+        """
+        Получает информацию о ценах на отели и транспорт между городами от всех поставщиков сразу.
+
+        :param departure_city: Город отправления.
+        :param arrival_city: Город назначения.
+        :param check_in: Дата заселения (в формате YYYY-MM-DD).
+        :param check_out: Дата выселения (в формате YYYY-MM-DD).
+        :param adults: Количество гостей (по умолчанию 2).
+        :param currency: Валюта ответа (по умолчанию 'rub').
+        :return: Словарь с лучшими ценами hotel_price и transport_price и статусом каждого поставщика
+                 в providers (ответившие поставщики попадают в ответ, даже если другие не успели).
+        """
+        query = self.make_query(departure_city, arrival_city, check_in, check_out, adults, currency)
+        results = await self.collect(query)
+        return {
+            "hotel_price": self.best_price(results, "hotel"),
+            "transport_price": self.best_price(results, "transport"),
+            "providers": results
+        }
+
+    async def get_hotel_price(self, location, check_in, check_out, currency='rub', adults=2):
+        """
+        Получает информацию о ценах на проживание в отелях в указанном городе.
+
+        :return: Лучшая цена среди поставщиков отелей.
+        """
+        query = self.make_query(None, location, check_in, check_out, adults, currency)
+        return self.best_price(await self.collect(query, kind="hotel"), "hotel")
+
+    async def get_transport_price(self, from_station, to_station, date):
         """
         Получает стоимость перемещения из одного города в другой.
-        
-        :param from_station: Станция отправления.
-        :param to_station: Станция назначения.
+
+        :param from_station: Город отправления.
+        :param to_station: Город назначения.
         :param date: Дата поездки.
-        :param api_key: API ключ для доступа к сервису.
-        :return: Стоимость перемещения или сообщение о том, что сервисы ещё не настроены.
+        :return: Лучшая цена среди поставщиков транспорта или сообщение о том, что сервисы ещё не настроены.
         """
-        return "Сервисы ещё не настроены"
+        query = self.make_query(from_station, to_station, date, date)
+        return self.best_price(await self.collect(query, kind="transport"), "transport")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
 
 
 # API РАЗНЫХ ИСТОЧНИКОВ ДАННЫХ О МАРШРУТАХ
@@ -0,0 +1,216 @@
+import bisect
+import csv
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from functools import lru_cache
+
+import numpy as np
+import requests
+
+TUTU_ROUTES_URL = "https://support.travelpayouts.com/hc/article_attachments/360031345731/tutu_routes.csv.zip"
+INDEX_FORMAT_VERSION = 2
+
+
+def normalize_name(name):
+    """Lower-case a station name, treat ё as е and reduce punctuation to single spaces."""
+    name = name.lower().replace("ё", "е")
+    return " ".join(re.sub(r"[^\w]+", " ", name).split())
+
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StationIndex:
+    def __init__(self, stations):
+        """
+        In-memory index of station names.
+
+        Lookups try, in order: the exact normalized name, the shortest name starting with the
+        query (so "Воронеж" finds "Воронеж 1"), and the name sharing the most trigrams with the
+        query (for typos such as "Варонеж").
+
+        :param stations: Iterable of (station name, station code) pairs.
+        """
+        codes = {}
+        for name, code in stations:
+            normalized = normalize_name(name)
+            if normalized:
+                codes.setdefault(normalized, code)
+        self.codes = codes
+        self.names = sorted(codes)
+        postings = {}
+        gram_counts = []
+        for name_id, name in enumerate(self.names):
+            grams = trigrams(name)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(name_id)
+        # Trigram -> ids of the names containing it, as arrays so matches are counted with bincount
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.gram_counts = np.array(gram_counts, dtype=np.int32)
+        self.lookup = lru_cache(maxsize=4096)(self.resolve_uncached)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix_match(self, name):
+        start = bisect.bisect_left(self.names, name)
+        matches = []
+        for candidate in self.names[start:start + 64]:
+            if not candidate.startswith(name):
+                break
+            matches.append(candidate)
+        return min(matches, key=len) if matches else None
+
+    def fuzzy_match(self, name, min_similarity=0.5):
+        """Return the name with the highest trigram Jaccard similarity to name, if above min_similarity."""
+        grams = trigrams(name)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not postings:
+            return None
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        similarity = shared / (len(grams) + self.gram_counts - shared)
+        best = int(np.argmax(similarity))
+        return self.names[best] if similarity[best] > min_similarity else None
+
+    def resolve_uncached(self, name):
+        name = normalize_name(name)
+        if not name:
+            return None
+        if name in self.codes:
+            return self.codes[name]
+        match = self.prefix_match(name) or self.fuzzy_match(name)
+        return self.codes[match] if match else None
+
+    def resolve(self, name):
+        """Return the code of the station best matching name, or None."""
+        return self.lookup(name)
+
+    @classmethod
+    def from_tutu_csv(cls, lines):
+        """Build the index from the lines of tutu_routes.csv (departure and arrival stations)."""
+        def stations():
+            for row in csv.DictReader(lines, delimiter=";"):
+                yield row["departure_station_name"], row["departure_station_id"]
+                yield row["arrival_station_name"], row["arrival_station_id"]
+        return cls(stations())
+
+    def save(self, path):
+        """
+        Write the index to path atomically, so a concurrent reader never sees a partial file.
+
+        The file is a plain .npz of string and integer arrays (no pickles), so loading it cannot
+        run code even if someone else managed to write it.
+        """
+        grams = sorted(self.postings)
+        lengths = [len(self.postings[gram]) for gram in grams]
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=".", suffix=".npz", delete=False) as temp_file:
+            np.savez(
+                temp_file,
+                version=np.array(INDEX_FORMAT_VERSION),
+                names=np.array(self.names, dtype=str),
+                codes=np.array([self.codes[name] for name in self.names], dtype=str),
+                gram_counts=self.gram_counts,
+                grams=np.array(grams, dtype=str),
+                posting_offsets=np.cumsum([0] + lengths, dtype=np.int64),
+                posting_ids=np.concatenate([self.postings[gram] for gram in grams]) if grams else np.empty(0, dtype=np.int32)
+            )
+        os.replace(temp_file.name, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save() without rebuilding it."""
+        with np.load(path, allow_pickle=False) as state:
+            if int(state["version"]) != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported station index version: {int(state['version'])}")
+            names = state["names"].tolist()
+            codes = state["codes"].tolist()
+            gram_counts = state["gram_counts"]
+            grams = state["grams"].tolist()
+            offsets = state["posting_offsets"]
+            ids = state["posting_ids"]
+        index = cls.__new__(cls)
+        index.names = names
+        index.codes = dict(zip(names, codes))
+        index.postings = {gram: ids[offsets[i]:offsets[i + 1]] for i, gram in enumerate(grams)}
+        index.gram_counts = gram_counts
+        index.lookup = lru_cache(maxsize=4096)(index.resolve_uncached)
+        return index
+
+
+class StationDirectory:
+    def __init__(self, path, url=TUTU_ROUTES_URL, refresh_interval=24 * 3600, timeout=60):
+        """
+        Station index shared by the transport providers, kept on disk and refreshed on a schedule.
+
+        On start the index saved at path is loaded (if any), so lookups work right away; the
+        routes file is downloaded again in a background thread once the saved copy is older
+        than refresh_interval, and the new index replaces the old one without blocking lookups.
+
+        :param path: File the built index is saved to.
+        :param url: Address of the zipped tutu_routes.csv.
+        :param refresh_interval: Seconds between downloads of the routes file.
+        :param timeout: Timeout of the download in seconds.
+        """
+        self.path = path
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.index = None
+        self.loaded_at = 0.0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            try:
+                self.index = StationIndex.load(self.path)
+                self.loaded_at = os.path.getmtime(self.path)
+            except Exception as e:
+                print(f"Error loading station index: {str(e)}")
+        self.thread = threading.Thread(target=self.refresh_loop, name="station-index", daemon=True)
+        self.thread.start()
+
+    def refresh_loop(self):
+        while not self.stopped.is_set():
+            wait = self.loaded_at + self.refresh_interval - time.time()
+            if wait <= 0:
+                try:
+                    self.refresh()
+                    wait = self.refresh_interval
+                except Exception as e:
+                    print(f"Error refreshing station index: {str(e)}")
+                    wait = min(self.refresh_interval, 600)  # Retry sooner after a failed download
+            self.stopped.wait(wait)
+
+    def refresh(self):
+        """Download the routes file, rebuild the index, save it and swap it in."""
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            csv_name = next(name for name in archive.namelist() if name.endswith(".csv"))
+            with archive.open(csv_name) as f:
+                index = StationIndex.from_tutu_csv(io.TextIOWrapper(f, encoding="utf-8"))
+        index.save(self.path)
+        self.index = index
+        self.loaded_at = time.time()
+        print(f"Station index refreshed: {len(index)} stations")
+
+    def resolve(self, name):
+        """Return the station code for name, or None if no station matches."""
+        index = self.index
+        if index is None:
+            raise LookupError("Индекс станций ещё не загружен.")
+        return index.resolve(name)
+
+    def stop(self):
+        self.stopped.set()
@@ -1,77 +1,113 @@
 import os
-import psycopg2
 import bcrypt
 from datetime import date
 
 class UserManager:
-    def __init__(self, db_url):
-        self.conn = psycopg2.connect(db_url)
-        self.cursor = self.conn.cursor()
+    def __init__(self, db_pool, bcrypt_rounds=12):
+        """
+        :param db_pool: Shared DatabasePool used for all queries.
+        :param bcrypt_rounds: bcrypt work factor for new password hashes (each step doubles the cost).
+        """
+        self.db_pool = db_pool
+        self.bcrypt_rounds = bcrypt_rounds
 
     def hash_password(self, password):
         """Hashes a password using bcrypt."""
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=self.bcrypt_rounds)).decode('utf-8')
 
     def verify_password(self, password, hashed):
         """Verifies a password against a hashed password."""
-        return bcrypt.checkpw(password.encode('utf-8'), hashed)
+        if hashed.startswith('\\x'):
+            # Hashes stored by older versions went through psycopg2 as bytes (bytea hex text)
+            hashed = bytes.fromhex(hashed[2:]).decode('utf-8')
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
     def register_user(self, username, email, phone, name, description, avatar, birth, city, sports, events, password, root=False, admin=False):
         try:
             hashed_password = self.hash_password(password)
-            self.cursor.execute("""
-                INSERT INTO users (username, email, phone, name, description, avatar, birth, city, sports, events, password, root, admin)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (username, email, phone, name, description, avatar, birth, city, sports, events, hashed_password, root, admin))
-            self.conn.commit()
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO users (username, email, phone, name, description, avatar, birth, city, sports, events, password, root, admin)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (username, email, phone, name, description, avatar, birth, city, sports, events, hashed_password, root, admin))
+                conn.commit()
             print("User  registered successfully.")
         except Exception as e:
             print(f"Error registering user: {str(e)}")
-            self.conn.rollback()
 
     def edit_user(self, user_id, **kwargs):
         try:
             update_fields = []
             values = []
             
+            # Roles are changed through set_roles and registrations through register_for_event
             for key, value in kwargs.items():
-                if key in ['username', 'email', 'phone', 'name', 'description', 'avatar', 'birth', 'city', 'sports', 'events', 'root', 'admin']:
+                if key in ['username', 'email', 'phone', 'name', 'description', 'avatar', 'birth', 'city', 'sports']:
                     update_fields.append(f"{key} = %s")
                     values.append(value)
+            if not update_fields:
+                return
 
             values.append(user_id)
             query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
-            self.cursor.execute(query, values)
-            self.conn.commit()
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(query, values)
+                conn.commit()
             print("User  updated successfully.")
         except Exception as e:
             print(f"Error updating user: {str(e)}")
-            self.conn.rollback()
+
+    def set_roles(self, user_id, admin=None, root=None):
+        """
+        Grants or revokes the admin and root flags; callers must check the permissions first.
+
+        :return: False if there is no such user.
+        """
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE users SET admin = COALESCE(%s, admin), root = COALESCE(%s, root) WHERE id = %s",
+                (admin, root, user_id)
+            )
+            updated = cursor.rowcount > 0
+            conn.commit()
+        return updated
 
     def delete_user(self, user_id):
         try:
-            self.cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-            self.conn.commit()
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+                conn.commit()
             print("User  deleted successfully.")
         except Exception as e:
             print(f"Error deleting user: {str(e)}")
-            self.conn.rollback()
+
+    def authenticate(self, username, password):
+        """
+        Checks the credentials and records the login.
+
+        :return: Dict with "id", "username", "root" and "admin", or None if the credentials are wrong.
+        """
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id, password, root, admin FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+        if not user:
+            print("User  not found.")
+            return None
+        if not self.verify_password(password, user[1]):
+            print("Invalid password.")
+            return None
+
+        with self.db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s", (user[0],))
+            conn.commit()
+        return {"id": user[0], "username": username, "root": user[2], "admin": user[3]}
 
     def login_user(self, username, password):
         try:
-            self.cursor.execute("SELECT password FROM users WHERE username = %s", (username,))
-            user = self.cursor.fetchone()
-            if user:
-                hashed_password = user[0]
-                if self.verify_password(password, hashed_password):
-                    print("Login successful.")
-                    return True  # User logged in successfully
-                else:
-                    print("Invalid password.")
-                    return False
-            else:
-                print("User  not found.")
-                return False
+            if self.authenticate(username, password):
+                print("Login successful.")
+                return True  # User logged in successfully
+            return False
         except Exception as e:
             print(f"Error logging in user: {str(e)}")
             return False
@@ -80,7 +116,8 @@ class UserManager:
         """Fetches user details based on any given parameters."""
         try:
             # Construct the base query
-            base_query = "SELECT username, email, phone, name, description, avatar, birth, city, sports, events, root, admin FROM users WHERE "
+            # Registrations live in event_participants; users.events is no longer written
+            base_query = "SELECT username, email, phone, name, description, avatar, birth, city, sports, ARRAY(SELECT event_id FROM event_participants WHERE user_id = users.id ORDER BY registered_at) AS events, root, admin FROM users WHERE "
             conditions = []
             values = []
 
@@ -96,8 +133,9 @@ class UserManager:
 
             # Combine conditions into the query
             query = base_query + " AND ".join(conditions)
-            self.cursor.execute(query, values)
-            users = self.cursor.fetchall()
+            with self.db_pool.connection() as conn, conn.cursor() as cursor:
+                cursor.execute(query, values)
+                users = cursor.fetchall()
 
             if multiple:
                 # Return a list of users
@@ -144,7 +182,3 @@ class UserManager:
             print(f"Error fetching user: {str(e)}")
             return None
 
-    def close(self):
-        self.cursor.close()
-        self.conn.close()
-
@@ -1,10 +1,33 @@
+import asyncio
+import io
+import json
+import os
+import threading
+import time
 import pytest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch
-from src.main import app, parse_and_save_pdf, UserManager, CompetitionSearcher, TravelService
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+os.environ.setdefault("JWT_SECRET", "test-secret-of-at-least-32-bytes!!")
+
+from src.main import app, cache, db_pool, tokens, parse_and_save_pdf, UserManager, CompetitionSearcher, TravelService
+from modules.router_conroller import HotellookProvider, TravelProvider
+from modules.auth_controller import TokenManager
+from modules.ai_controller import HashingEmbedder, SemanticSearchIndex
+from modules.ingest_controller import IngestJobManager
+from modules.cache_controller import CacheManager
+from modules.metrics_controller import MetricsMiddleware
+from modules.rag_controller import FullTextSearcher, SearchIndexService
+from modules.station_controller import StationIndex
 
 client = TestClient(app)
 
+def auth_headers(user_id, admin=False):
+    token, _ = tokens.issue({"id": user_id, "username": f"user{user_id}", "root": False, "admin": admin})
+    return {"Authorization": f"Bearer {token}"}
+
 @pytest.fixture
 def mock_pdf_parser():
     with patch('modules.pdf_parser.PDFParser') as mock:
@@ -23,30 +46,263 @@ def test_upload_pdf_db_invalid_extension():
     assert response.status_code == 400
     assert response.json()["detail"] == "Only PDF files are allowed."
 
+@patch('src.main.search_index')
+@patch('src.main.ingestor')
+@patch('src.main.PDFParser')
+def test_parse_and_save_pdf_bulk_ingest(mock_parser, mock_ingestor, mock_search_index):
+    rows = [("Sport1", "Individual", "EKP123", "2024-01-01", "2024-01-02", "City1",
+             "Discipline1", "Class1", "Country1", 10, "M18-25")]
+    mock_parser.return_value.parse_iter.return_value = iter(rows)
+    batch_result = {"inserted": 1, "updated": 0, "skipped": 0, "inserted_rows": rows, "updated_rows": []}
+
+    def ingest_stream(entries, batch_size, on_batch):
+        assert list(entries) == rows
+        on_batch(batch_result)
+        return {"inserted": 1, "updated": 0, "skipped": 0, "batches": 1}
+
+    mock_ingestor.ingest_stream.side_effect = ingest_stream
+
+    result = parse_and_save_pdf("/tmp/test.pdf")
+    assert result["inserted"] == 1
+    mock_search_index.add_competitions.assert_called_once_with(rows)
+    mock_search_index.build.assert_not_called()
+
+@patch('src.main.ingest_jobs')
+def test_upload_pdf_db_duplicate_content(mock_ingest_jobs):
+    mock_ingest_jobs.submit.return_value = ({"id": 7, "status": "done"}, False)
+    response = client.post(
+        "/upload_pdf_db",
+        files={"file": ("calendar.pdf", b"%PDF-1.4 same content")}
+    )
+    assert response.status_code == 200
+    assert response.json()["job_id"] == 7
+    assert response.json()["message"] == "This PDF was already uploaded."
+
+@patch('src.main.ingest_jobs')
+def test_get_ingest_job_not_found(mock_ingest_jobs):
+    mock_ingest_jobs.get.return_value = None
+    response = client.get("/ingest_jobs/42")
+    assert response.status_code == 404
+
+def test_ingest_job_is_processed_only_once_claimed(tmp_path):
+    file_path = tmp_path / "upload.pdf"
+    file_path.write_bytes(b"%PDF")
+    process = Mock()
+    pool = MagicMock()
+    cursor = pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    manager = IngestJobManager(pool, process)
+
+    # Another worker holds the job's lock, or has already claimed and finished it
+    cursor.fetchone.side_effect = [(False,)]
+    manager.run(7, str(file_path))
+    cursor.fetchone.side_effect = [(True,), None]
+    manager.run(7, str(file_path))
+    process.assert_not_called()
+    assert file_path.exists()
+    assert "pg_advisory_unlock" in cursor.execute.call_args[0][0]
+
+    cursor.fetchone.side_effect = [(True,), (7,)]
+    manager.run(7, str(file_path))
+    process.assert_called_once()
+    claim = [call[0][0] for call in cursor.execute.call_args_list if "SET status = 'running'" in call[0][0]][-1]
+    assert "status IN ('queued', 'running')" in claim and "rows_parsed = 0" in claim
+    assert not file_path.exists()
+    manager.shutdown()
+
 def test_get_events_no_keywords():
     response = client.get("/get_events")
     assert response.status_code == 400
     assert response.json()["detail"] == "No keywords provided for search."
 
-@patch('modules.rag_controller.CompetitionSearcher')
-def test_get_events_success(mock_searcher):
-    mock_searcher.return_value.search_competitions_by_keywords.return_value = [
-        ("Sport1", "Individual", "EKP123", "2024-01-01", "2024-01-02", "City1", 
-         "Discipline1", "Class1", "Country1", 10, "M18-25")
+@patch('src.main.search_index')
+def test_get_events_success(mock_search_index):
+    mock_search_index.search.return_value = [
+        (("Sport1", "Individual", "EKP123", "2024-01-01", "2024-01-02", "City1", 
+          "Discipline1", "Class1", "Country1", 10, "M18-25"), 0.75)
     ]
     
-    response = client.get("/get_events?keywords=sport")
+    response = client.get("/get_events?keywords=sport&k=3&mode=fulltext")
     assert response.status_code == 200
     assert len(response.json()["events"]) == 1
+    assert response.json()["events"][0]["score"] == 0.75
+    mock_search_index.search.assert_called_once_with("sport", k=3, extra_columns=["id", "participants_count"], mode="fulltext")
+    assert client.get("/get_events?keywords=sport&mode=unknown").status_code == 400
 
-@patch('modules.router_conroller.TravelService')
-def test_travel_info_success(mock_travel):
-    mock_travel.return_value.get_hotel_price.return_value = "100"
-    mock_travel.return_value.get_transport_price.return_value = "50"
-    
-    response = client.get("/travel_info?departure_city=City1&arrival_city=City2&check_in=2024-01-01&check_out=2024-01-02")
+def test_hybrid_search_blends_vector_and_fulltext_scores():
+    service = SearchIndexService(db_pool=None, hybrid_weight=0.75)
+    row = lambda ekp_number: ("Sport1", None, ekp_number)
+    blended = service.blend([(row("A"), 0.8), (row("B"), 0.4)], [(row("B"), 0.6), (row("C"), 0.9)], k=2)
+    assert [(r[2], round(score, 3)) for r, score in blended] == [("A", 0.6), ("B", 0.45)]
+    assert FullTextSearcher.build_query("бокс, Казань & (юниоры)") == "бокс | Казань | юниоры"
+
+@pytest.mark.parametrize("backend", ["faiss", "sparse"])
+def test_vector_search_returns_only_matching_rows(backend):
+    searcher = CompetitionSearcher(db_pool=None, backend=backend)
+    searcher.data = [("Бокс", "Личные", f"EKP{i}", None, None, city, "бокс", "юниоры", "Россия", 10, None)
+                     for i, city in enumerate(["Москва", "Казань", "Сочи"])]
+    searcher.create_feature_vectors()
+    searcher.build_index()
+
+    # Words outside the vocabulary give a zero query vector, which matches nothing
+    oov, city, mixed = searcher.search_many(["футбол", "казань", "футбол, казань"], k=5)
+    assert oov == []
+    assert [row[2] for row, _ in city] == [row[2] for row, _ in mixed] == ["EKP1"]  # rows without the term are dropped
+    assert city[0][1] > 0
+
+@patch('src.main.search_index')
+def test_get_events_cached_until_invalidated(mock_search_index):
+    mock_search_index.search.return_value = [
+        (("Sport1", "Individual", "EKP123", "2024-01-01", "2024-01-02", "City1",
+          "Discipline1", "Class1", "Country1", 10, "M18-25", 1, 0), 0.5)
+    ]
+
+    for keywords in ("Cached Sport", "cached  sport"):
+        response = client.get("/get_events", params={"keywords": keywords})
+        assert response.status_code == 200
+        assert response.json()["events"][0]["id"] == 1
+    assert mock_search_index.search.call_count == 1
+
+    cache.invalidate("events")
+    client.get("/get_events", params={"keywords": "cached sport"})
+    assert mock_search_index.search.call_count == 2
+
+class DictRedis:
+    """Just enough of redis.Redis for CacheManager."""
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+
+@pytest.mark.parametrize("use_redis", [False, True])
+def test_cache_does_not_keep_values_loaded_across_an_invalidation(use_redis):
+    manager = CacheManager()
+    if use_redis:
+        manager.redis = DictRedis()
+
+    def stale_loader():
+        manager.invalidate("events")  # new rows arrive while the old result is computed
+        return "stale"
+
+    assert manager.get_or_set("events", "q", stale_loader) == "stale"
+    assert manager.get_or_set("events", "q", lambda: "fresh") == "fresh"
+    assert manager.get_or_set("events", "q", lambda: "unused") == "fresh"
+
+@patch('src.main.search_index')
+def test_get_events_batch_success(mock_search_index):
+    mock_search_index.search_many.return_value = [
+        [(("Sport1", "Individual", "EKP123", "2024-01-01", "2024-01-02", "City1",
+           "Discipline1", "Class1", "Country1", 10, "M18-25", 1, 3), 0.5)],
+        []
+    ]
+
+    response = client.post("/get_events/batch", json=["sport", "nothing"])
     assert response.status_code == 200
-    assert response.json() == {"hotel_price": "100", "transport_price": "50"}
+    results = response.json()["results"]
+    assert [len(r["events"]) for r in results] == [1, 0]
+    event = results[0]["events"][0]
+    assert (event["ekp_number"], event["id"], event["participants_count"]) == ("EKP123", 1, 3)
+    assert mock_search_index.search_many.call_args.kwargs["extra_columns"] == ["id", "participants_count"]
+
+def test_travel_info_success():
+    providers = {
+        "hotellook": {"status": "ok", "result": 100, "kind": "hotel", "elapsed_ms": 12.0},
+        "tutu": {"status": "ok", "result": 50, "kind": "transport", "elapsed_ms": 8.0},
+    }
+    with patch('src.main.travel_service.collect', AsyncMock(return_value=providers)) as mock_collect:
+        response = client.get("/travel_info?departure_city=City1&arrival_city=City2&check_in=2024-01-01&check_out=2024-01-02")
+    assert response.status_code == 200
+    assert response.json() == {"hotel_price": 100, "transport_price": 50, "providers": providers}
+    query = mock_collect.call_args[0][0]
+    assert (query["departure_city"], query["arrival_city"], query["adults"]) == ("City1", "City2", 2)
+
+@pytest.fixture
+def hotellook_stub():
+    """Local stand-in for engine.hotellook.com that counts requests."""
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            time.sleep(0.2)  # Slow enough for concurrent lookups to overlap
+            body = json.dumps([{"priceAvg": 100}, {"priceAvg": 300}]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+
+def test_hotel_price_cached_and_coalesced(hotellook_stub):
+    base_url, requests_seen = hotellook_stub
+    service = TravelService([HotellookProvider(base_url=base_url)])
+
+    async def lookups():
+        prices = await asyncio.gather(*(service.get_hotel_price("Moscow", "2024-01-01", "2024-01-02") for _ in range(8)))
+        assert prices == [200] * 8
+        assert len(requests_seen) == 1  # concurrent identical lookups share one upstream call
+
+        assert await service.get_hotel_price("moscow ", "2024-01-01", "2024-01-02") == 200
+        assert len(requests_seen) == 1  # served from the cache
+        await service.get_hotel_price("Moscow", "2024-01-01", "2024-01-03")
+        assert len(requests_seen) == 2
+        await service.close()
+
+    asyncio.run(lookups())
+
+class SleepyProvider(TravelProvider):
+    def __init__(self, name, kind, delay, result, timeout):
+        super().__init__("http://unused", timeout=timeout)
+        self.name, self.kind, self.delay, self.result = name, kind, delay, result
+
+    async def fetch(self, client, query):
+        await asyncio.sleep(self.delay)
+        return self.result
+
+def test_travel_info_fans_out_with_partial_results():
+    service = TravelService([
+        SleepyProvider("hotels", "hotel", 0.3, 5000, timeout=1),
+        SleepyProvider("trains", "transport", 0.3, 1200, timeout=1),
+        SleepyProvider("planes", "transport", 5, 900, timeout=0.5),
+    ])
+
+    started = time.perf_counter()
+    info = asyncio.run(service.get_travel_info("Voronezh", "Moscow", "2024-01-01", "2024-01-02"))
+    assert time.perf_counter() - started < 0.9  # bounded by the slowest deadline, not the sum
+
+    assert info["hotel_price"] == 5000
+    assert info["transport_price"] == 1200
+    assert info["providers"]["planes"]["status"] == "timeout"
+
+def test_station_index_lookup_and_persistence(tmp_path):
+    routes = io.StringIO(
+        "departure_station_id;departure_station_name;arrival_station_id;arrival_station_name\n"
+        "2000001;Москва;2014000;Воронеж 1\n"
+        "2000000;Москва Казанский вокзал;2004000;Санкт-Петербург Главный\n"
+    )
+    index = StationIndex.from_tutu_csv(routes)
+    assert index.resolve("МОСКВА") == "2000001"  # exact normalized name
+    assert index.resolve("Воронеж") == "2014000"  # prefix
+    assert index.resolve("Варонеж 1") == "2014000"  # fuzzy
+    assert index.resolve("Владивосток") is None
+
+    index.save(str(tmp_path / "stations.npz"))
+    loaded = StationIndex.load(str(tmp_path / "stations.npz"))
+    assert loaded.resolve("санкт петербург") == "2004000"
+    assert loaded.resolve("Варонеж 1") == "2014000"  # trigram postings survive the round trip
 
 def test_register_user_success():
     test_user = {
@@ -75,28 +331,237 @@ def test_auth_user_invalid_credentials():
         assert response.json()["detail"] == "Invalid username or password."
 
 def test_get_sport_names_success():
-    with patch('psycopg2.connect') as mock_conn:
-        mock_cursor = Mock()
-        mock_conn.return_value.cursor.return_value = mock_cursor
+    cache.invalidate("sport_names")
+    with patch('src.main.db_pool') as mock_pool:
+        mock_cursor = mock_pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
         mock_cursor.fetchall.return_value = [("Sport1",), ("Sport2",)]
-        
-        response = client.get("/get_sport_names")
-        assert response.status_code == 200
-        assert response.json() == {"sport_names": ["Sport1", "Sport2"]}
+
+        for _ in range(2):
+            response = client.get("/get_sport_names")
+            assert response.status_code == 200
+            assert response.json() == {"sport_names": ["Sport1", "Sport2"]}
+        mock_cursor.execute.assert_called_once()  # the second request is served from the cache
+    cache.invalidate("sport_names")
 
 def test_comment_event_invalid_rate():
     response = client.post(
-        "/comment_event/1/1?rate=6&text=test"
+        "/comment_event/1/1?rate=6&text=test",
+        headers=auth_headers(1)
     )
     assert response.status_code == 400
     assert response.json()["detail"] == "Rate must be between 0 and 5."
 
 def test_register_for_event_full():
-    with patch('psycopg2.connect') as mock_conn:
-        mock_cursor = Mock()
-        mock_conn.return_value.cursor.return_value = mock_cursor
-        mock_cursor.fetchone.return_value = (2, [1, 2])  # max_people_count=2, peoples=[1,2]
+    with patch('src.main.db_pool') as mock_pool:
+        mock_conn = mock_pool.connection.return_value.__enter__.return_value
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchone.side_effect = [(0, 0), (False,)]  # no free seat, event exists, not registered yet
         
-        response = client.post("/register_for_event/1/3")
+        response = client.post("/register_for_event/1/3", headers=auth_headers(3))
         assert response.status_code == 400
         assert response.json()["detail"] == "Event is full."
+        mock_conn.commit.assert_not_called()
+
+def test_register_for_event_success():
+    with patch('src.main.db_pool') as mock_pool:
+        mock_conn = mock_pool.connection.return_value.__enter__.return_value
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchone.return_value = (1, 1)  # seat taken and participant recorded
+        
+        response = client.post("/register_for_event/1/3", headers=auth_headers(3))
+        assert response.status_code == 200
+        mock_conn.commit.assert_called_once()
+
+def test_register_for_event_requires_token_of_same_user():
+    assert client.post("/register_for_event/1/3").status_code == 401
+    assert client.post("/register_for_event/1/3", headers={"Authorization": "Bearer forged"}).status_code == 401
+    assert client.post("/register_for_event/1/3", headers=auth_headers(4)).status_code == 403
+
+def test_non_admin_cannot_promote_themselves():
+    with patch('src.main.user_manager.db_pool') as mock_pool:
+        mock_conn = mock_pool.connection.return_value.__enter__.return_value
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+
+        response = client.put("/edit_user/3", json={"name": "Ivan", "admin": True, "root": True}, headers=auth_headers(3))
+        assert response.status_code == 200
+        query, values = mock_cursor.execute.call_args[0]
+        assert "admin" not in query and "root" not in query
+        assert values == ["Ivan", 3]
+
+        mock_cursor.execute.reset_mock()
+        assert client.put("/set_user_roles/3?admin=true", headers=auth_headers(3)).status_code == 403
+        # Admins may grant admin, but only root may grant root
+        assert client.put("/set_user_roles/3?root=true", headers=auth_headers(4, admin=True)).status_code == 403
+        mock_cursor.execute.assert_not_called()
+
+        mock_cursor.rowcount = 1
+        assert client.put("/set_user_roles/3?admin=true", headers=auth_headers(4, admin=True)).status_code == 200
+        assert mock_cursor.execute.call_args[0][1] == (True, None, 3)
+
+def test_deleting_a_user_releases_their_seats():
+    with db_pool.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (username, email, password) VALUES ('seat_holder', 'seat_holder@example.com', 'x')
+            RETURNING id
+        """)
+        user_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO competitions (ekp_number, max_people_count, participants_count) VALUES ('EKP-SEATS', 1, 1)
+            RETURNING id
+        """)
+        event_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO event_participants (event_id, user_id) VALUES (%s, %s)", (event_id, user_id))
+        conn.commit()
+
+    try:
+        assert client.delete(f"/delete_user/{user_id}", headers=auth_headers(user_id)).status_code == 200
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT participants_count FROM competitions WHERE id = %s", (event_id,))
+            assert cursor.fetchone()[0] == 0
+    finally:
+        with db_pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            cursor.execute("DELETE FROM competitions WHERE id = %s", (event_id,))
+            conn.commit()
+
+@patch('src.main.user_manager')
+def test_auth_user_issues_token(mock_user_manager):
+    mock_user_manager.authenticate.return_value = {"id": 7, "username": "testuser", "root": False, "admin": False}
+    response = client.post("/auth_user?username=testuser&password=secret")
+    assert response.status_code == 200
+    assert response.json()["user_id"] == 7
+    assert tokens.verify(response.json()["access_token"])["id"] == 7
+
+def test_token_manager_requires_a_shared_secret():
+    with pytest.raises(ValueError):
+        TokenManager(None)
+    # Two workers with the same secret accept each other's tokens
+    token, _ = TokenManager("shared-secret-of-at-least-32-bytes").issue({"id": 5, "username": "u", "root": False, "admin": False})
+    assert TokenManager("shared-secret-of-at-least-32-bytes").verify(token)["id"] == 5
+    assert TokenManager(None, allow_random_secret=True).secret
+
+def test_password_hashing_rounds_and_legacy_hashes():
+    manager = UserManager(db_pool=None, bcrypt_rounds=4)
+    hashed = manager.hash_password("secret")
+    assert hashed.startswith("$2b$04$")
+    assert manager.verify_password("secret", hashed)
+    # Hashes written as bytes by older versions are stored as bytea hex text
+    assert manager.verify_password("secret", "\\x" + hashed.encode().hex())
+    assert not manager.verify_password("wrong", hashed)
+
+def test_events_keyset_pagination():
+    row = lambda event_id: ("Sport1", "Individual", f"EKP{event_id}", datetime(2024, 1, event_id, 10), None, "City1",
+                            "Discipline1", "Class1", "Country1", 10, None, event_id, 0)
+    with patch('src.main.db_pool') as mock_pool:
+        mock_cursor = mock_pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchall.return_value = [row(1), row(2), row(3)]  # limit + 1 rows: there is a next page
+        response = client.get("/events?sport=Sport1&city=City1&limit=2")
+        assert response.status_code == 200
+        assert [event["id"] for event in response.json()["events"]] == [1, 2]
+        query, params = mock_cursor.execute.call_args[0]
+        assert "OFFSET" not in query and params == ["Sport1", "City1", 3]
+
+        mock_cursor.fetchall.return_value = [row(3)]
+        response = client.get(f"/events?sport=Sport1&city=City1&limit=2&cursor={response.json()['next_cursor']}")
+        assert response.json()["next_cursor"] is None
+        query, params = mock_cursor.execute.call_args[0]
+        assert "(date_start, id) > (%s, %s)" in query
+        assert params == ["Sport1", "City1", datetime(2024, 1, 2, 10), 2, 3]
+
+    assert client.get("/events?cursor=garbage").status_code == 400
+
+def test_semantic_search_with_hashing_embedder():
+    rows = [
+        ("Борьба", "Командные", "EKP1", datetime(2024, 4, 10), None, "Казань", "вольная борьба", "юниоры", "Россия", 50, None),
+        ("Борьба", "Командные", "EKP2", datetime(2024, 12, 5), None, "Москва", "вольная борьба", "взрослые", "Россия", 50, None),
+        ("Плавание", "Личные", "EKP3", datetime(2024, 4, 20), None, "Казань", "50м вольный стиль", "юниоры", "Россия", 20, None),
+    ]
+    index = SemanticSearchIndex(db_pool=None, embedder=HashingEmbedder(dim=256), batch_size=2)
+    index.build(rows[:2])
+    index.add_competitions(rows[2:])
+    hits = index.search("юниорская борьба в Казани весной", k=3)
+    assert [row[2] for row, _ in hits][0] == "EKP1"
+    assert hits[0][1] > hits[1][1]
+    assert index.search("  ") == []
+
+    # Rows a concurrent rebuild already picked up are not added twice
+    index.add_competitions(rows[1:])
+    assert index.index.ntotal == 3
+
+def test_semantic_index_is_built_on_first_use():
+    pool = MagicMock()
+    cursor = pool.connection.return_value.__enter__.return_value.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [("Бокс", "Личные", "EKP1", None, None, "Казань", "бокс", "юниоры", "Россия", 10, None)]
+    index = SemanticSearchIndex(db_pool=pool, embedder=HashingEmbedder(dim=64))
+    index.add_competitions(cursor.fetchall.return_value)  # nothing to add to before the first build
+    assert not index.ready
+
+    for _ in range(2):
+        index.ensure_built()
+    cursor.execute.assert_called_once()
+    assert index.search("бокс казань", k=1)[0][0][2] == "EKP1"
+
+def test_ai_route_requires_query():
+    assert client.get("/ai_route").status_code == 400
+
+@pytest.mark.parametrize("backend", ["faiss", "sparse"])
+def test_search_snapshot_is_memory_mapped_and_shared(tmp_path, backend):
+    rows = [("Бокс", "Личные", f"EKP{i}", None, None, city, "бокс", "юниоры", "Россия", 10, None)
+            for i, city in enumerate(["Москва", "Казань", "Сочи", "Уфа"])]
+    writer = SearchIndexService(db_pool=None, backend=backend, refit_ratio=10, snapshot_dir=str(tmp_path), reload_interval=0)
+    writer.searcher = CompetitionSearcher(db_pool=None, backend=backend)
+    writer.searcher.data = rows[:3]
+    writer.searcher.create_feature_vectors()
+    writer.searcher.build_index()
+    writer.fitted_count = 3
+    (tmp_path / "tmpx1y2z3").write_text("left over")  # files that are not versions are ignored
+    writer.save_snapshot()
+
+    reader = SearchIndexService(db_pool=None, backend=backend, refit_ratio=10, snapshot_dir=str(tmp_path), reload_interval=0)
+    assert reader.load_snapshot()
+    assert not reader.searcher.feature_vectors.data.flags.writeable  # a view of the mapped file, not a copy
+    assert reader.search("казань")[0][0][2] == "EKP1"
+
+    # Rows ingested by one worker reach the others through the next snapshot
+    writer.add_competitions(rows[3:])
+    writer.save_snapshot()
+    assert len(reader.search("бокс", k=10)) == 4
+    assert reader.searcher.mapped
+    assert len([name for name in os.listdir(tmp_path) if not name.startswith(".")]) == 4  # two versions, CURRENT and the stray file
+
+    # Adding rows to a mapped index switches the worker to a private copy
+    reader.add_competitions([("Бокс", "Личные", "EKP9", None, None, "Казань", "бокс", "взрослые", "Россия", 10, None)])
+    assert not reader.searcher.mapped
+    assert len(reader.search("бокс", k=10)) == 5
+
+    # Another worker publishing in between neither drops the reader's unpublished row nor loses its own
+    writer.add_competitions([("Бокс", "Личные", "EKP10", None, None, "Сочи", "бокс", "взрослые", "Россия", 10, None)])
+    writer.save_snapshot()
+    reader.reload_if_stale()
+    assert len(reader.search("бокс", k=10)) == 6
+    reader.save_snapshot()
+    writer.reload_if_stale()
+    assert {row[2] for row, _ in writer.search("бокс", k=10)} == {f"EKP{i}" for i in (0, 1, 2, 3, 9, 10)}
+
+def test_metrics_endpoint_and_slow_request_log(capsys):
+    assert client.get("/events", params={"city": "Nowhere", "limit": 1}).status_code == 200
+
+    body = client.get("/metrics").text
+    assert 'cmse_http_request_duration_seconds_count{method="GET",route="/events"}' in body
+    assert 'cmse_http_requests_total{method="GET",route="/events",status="200"}' in body
+    assert 'cmse_sql_query_duration_seconds_count{query="select competitions"}' in body
+    assert "cmse_db_pool_in_use" in body
+    assert "# TYPE cmse_http_requests_in_flight gauge" in body
+
+    # Every request counts as slow here, so the log shows the SQL statements it ran
+    layer = app.middleware_stack
+    while not isinstance(layer, MetricsMiddleware):
+        layer = layer.app
+    with patch.object(layer, "slow_threshold", 1e-9):
+        client.get("/events", params={"city": "Nowhere"})
+    slow = [json.loads(line.split(": ", 1)[1]) for line in capsys.readouterr().out.splitlines()
+            if line.startswith("Slow request: ")]
+    assert slow[-1]["route"] == "/events" and slow[-1]["status"] == 200
+    assert {"kind": "sql", "name": "select competitions"} in [
+        {"kind": timing["kind"], "name": timing["name"]} for timing in slow[-1]["timings"]
+    ]